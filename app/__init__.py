@@ -1,9 +1,10 @@
 import time
 import re
+from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.staticfiles import StaticFiles
 from starlette.routing import Route
 from starlette.middleware.sessions import SessionMiddleware
@@ -12,13 +13,40 @@ from .utils.common import get_settings
 from .resources import router as resources_router
 from .front import router as front_router
 from .utils.front import FlashMessageMiddleware
+from .utils.redis import AsyncRedis
+from .utils.cache import read_cache
+from .utils.counters import counters
+from .utils.analytics import analytics_forwarder
+from .utils.feedback import feedback_dispatcher
+from .utils.spool import start_spools, stop_spools
+from .utils.file_index import file_index
+from .utils.compression import CompressionMiddleware
 
 
 # from .models import database
 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Runs once per worker, so every gunicorn worker owns its own pools.
+    await AsyncRedis.open()
+    await run_in_threadpool(file_index.build)
+    await read_cache.start()
+    await counters.start()
+    await start_spools()
+    await analytics_forwarder.start()
+    await feedback_dispatcher.start()
+    yield
+    await feedback_dispatcher.stop()
+    await analytics_forwarder.stop()  # failed sends still reach the spools, drop counts the counters' final flush
+    await stop_spools()
+    await counters.stop()  # final flush, before the pools go away
+    await read_cache.stop()
+    await AsyncRedis.close()
+
+
 def get_app() -> FastAPI:
-    app = FastAPI()
+    app = FastAPI(lifespan=lifespan)
 
     origins = [
         "http://localhost",
@@ -35,9 +63,13 @@ def get_app() -> FastAPI:
         allow_headers=["*"],
     )
 
+    settings = get_settings()
     app.add_middleware(
-        GZipMiddleware,
-        minimum_size=500
+        CompressionMiddleware,
+        minimum_size=settings.compression_minimum_size,
+        excluded_prefixes=tuple(settings.compression_excluded_prefixes),
+        excluded_extensions=tuple(settings.compression_excluded_extensions),
+        excluded_media_types=tuple(settings.compression_excluded_media_types),
     )
 
     @app.middleware("http")
@@ -2,7 +2,7 @@ import os
 import json
 from pydantic import Field
 from pydantic_settings import BaseSettings
-from typing import Dict, List
+from typing import Dict, List, Literal
 
 from logs import logger
 
@@ -11,11 +11,45 @@ class Settings(BaseSettings):
     app_name: str = "XLWebServices-fastapi"
     root_path: str = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
     file_cache_dir: str = "cache"
+    # cache_file hardlinks sources into the cache when it cannot reflink, turn off if sources get rewritten in place
+    file_cache_hardlink: bool = True
+    file_hash_chunk_size: int = 1024 * 1024  # bytes read at a time when hashing cached files
+    # Regen downloads (runtimes, XIVLauncher / Updater releases, plugin cache files)
+    download_chunk_size: int = 1024 * 1024
+    download_concurrency: int = 4
+    download_retries: int = 3  # interrupted downloads resume where they stopped
+    regen_processes: int = 0  # processes parsing / hashing plugins during regen, 0 for one per CPU, 1 to stay in-process
+    regen_pool_min_items: int = 32  # smaller batches are handled in-process
+    # Let the reverse proxy send /File/Get bodies: 'x-accel-redirect' (nginx, internal location prefix)
+    # or 'x-sendfile' (apache / lighttpd, absolute path is sent). Empty streams from Python.
+    file_offload: Literal['', 'x-accel-redirect', 'x-sendfile'] = ''
+    file_offload_prefix: str = '/_cache/'
+    file_cache_control: str = 'public, max-age=31536000, immutable'  # /File/Get names embed the sha256
     repo_cache_dir: str = "repo"
     redis_host: str = 'localhost'
     redis_port: str = '6379'
     redis_prefix: str = 'xlweb-fastapi|'
+    redis_max_connections: int = 64  # per worker, for the async pool used by request handlers
+    redis_socket_timeout: float = 5
+    redis_socket_connect_timeout: float = 2
+    # Download / launch counters are buffered per worker and flushed in one pipeline
+    counter_flush_interval: float = 1  # seconds
+    counter_flush_count: int = 500  # pending increments that trigger an early flush
+    read_cache_ttl: float = 600  # seconds, per-worker cache of regen data (invalidated via pub/sub), 0 to disable
+    read_cache_max_entries: int = 10000  # per worker, misses included
+    generation_keep: int = 2  # previous regen generations kept for readers still on them, older ones are deleted
     hosted_url: str = 'https://aonyx.ffxiv.wang'
+    # Sent with ETag on published documents (PluginMaster, VersionInfo, Meta...), CDN is purged on regen
+    document_cache_control: str = 'public, max-age=0, s-maxage=60, must-revalidate'
+    precompress_minimum_size: int = 1024  # documents at least this large get br/zstd/gzip variants at regen
+    # On-the-fly gzip policy, binary / already-compressed artifacts bypass compression
+    compression_minimum_size: int = 500
+    compression_excluded_prefixes: List[str] = Field(default_factory=lambda: ['/File/Get/'])
+    compression_excluded_extensions: List[str] = Field(default_factory=lambda: [
+        '.zip', '.7z', '.nupkg', '.exe', '.png', '.jpg', '.jpeg', '.gif', '.webp', '.ico', '.gz', '.br', '.zst'])
+    compression_excluded_media_types: List[str] = Field(default_factory=lambda: [
+        'application/zip', 'application/x-7z-compressed', 'application/octet-stream', 'application/gzip',
+        'application/zstd', 'application/x-msdownload', 'image/', 'audio/', 'video/', 'font/woff', 'text/event-stream'])
     github_token: str = ''
     cache_clear_key: str = ''
     xivl_repo: str = ''
@@ -40,8 +74,36 @@ class Settings(BaseSettings):
     crowdin_token: str = ''
     crowdin_project_name: str = 'Dalamud Plugins'
     default_pm_lang: str = 'en-US'  # Locale
+    feedback_page_size: int = 200  # feedback per admin page, paged by order id
+    feedback_export_batch_size: int = 500  # feedback fetched per pipeline by the streaming export
+    feedback_filter_ttl: int = 600  # seconds, lifetime of the plugin + status intersection an admin page / export pages through
+    # New feedback is announced to the webhook through a Redis stream outbox, see FeedbackDispatcher
+    feedback_webhook_timeout: float = 10  # seconds
+    feedback_outbox_concurrency: int = 4  # webhook posts in flight per worker
+    feedback_outbox_retry_interval: float = 60  # seconds before a failed notification is tried again
+    feedback_outbox_max_attempts: int = 30  # then it is moved to the feedback-outbox-dead stream
+    feedback_outbox_maxlen: int = 100000  # approximate cap of the outbox stream
     # Google Analytics
     ga_api_secret: str = ''
+    # Local rollups of /Dalamud/Analytics/Start (daily counters + HyperLogLog uniques), see /admin/analytics/rollup
+    analytics_aggregate: bool = False
+    analytics_retention_days: int = 90
+    # /Dalamud/Analytics/Start events are forwarded to GA / the collector by a background task per worker
+    analytics_queue_size: int = 10000  # events beyond this are dropped, counted in the analytics-dropped hash
+    analytics_batch_size: int = 25  # events drained per batch
+    analytics_batch_delay: float = 0.5  # seconds a batch may wait to fill up
+    analytics_collector_batch_size: int = 1  # payloads per collector POST, above 1 a JSON array of payloads is posted
+    analytics_drain_timeout: float = 5  # seconds to send what is still queued on shutdown
+    # Analytics payloads whose delivery fails are spooled to disk and replayed, empty disables
+    spool_dir: str = 'spool'
+    spool_fsync_interval: float = 0.2  # seconds, appends are written with one fsync per batch
+    spool_fsync_count: int = 200  # pending appends that trigger an early write
+    spool_segment_size: int = 4 * 1024 * 1024  # bytes, full segments are sealed for replay
+    spool_segment_age: float = 10  # seconds, idle segments are sealed too
+    spool_replay_rate: float = 20  # entries sent per second, per worker and target
+    spool_retry_interval: float = 30  # seconds a failing target is spooled to directly before it is tried again
+    spool_poll_interval: float = 5  # seconds between looks for sealed segments
+    spool_recover_interval: float = 60  # seconds between scans for segments left by dead workers
     # Plogon
     plogon_api_key: str = ''
     # ottercloud cdn
@@ -4,17 +4,22 @@ import asyncio
 import json
 from datetime import datetime, timezone, timedelta
 from io import BytesIO
+from typing import Literal
 
-from fastapi import APIRouter, HTTPException, Depends, Request, Form, UploadFile
-from fastapi.responses import RedirectResponse, PlainTextResponse, HTMLResponse, FileResponse
+from fastapi import APIRouter, HTTPException, Depends, Request, Form, UploadFile, Query
+from fastapi.responses import RedirectResponse, PlainTextResponse, HTMLResponse, FileResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
+from redis.asyncio import Redis
 
 from app.config import Settings
+from app.utils.analytics import get_analytics_day, load_rollup
 from app.utils.cdn.ottercloudcdn import OtterCloudCDN
 from app.utils.common import get_settings
 from app.utils.dalamud_log_analysis import analysis
+from app.utils.feedback import FEEDBACK_TZ, export_row, get_feedback_index, get_feedback_key_by_id, load_feedback, page_feedback, \
+    parse_feedback_key, resolve_feedback_index, stream_feedback_export, unindex_feedback
 from app.utils.front import flash
-from app.utils.redis import RedisFeedBack, Redis
+from app.utils.redis import get_redis, get_redis_feedback
 from app.utils.tasks import regen, flush_stg_code
 
 router = APIRouter()
@@ -70,10 +75,9 @@ async def front_admin_update():
 
 
 @router.get('/stg_code')
-async def front_admin_stg_code(request: Request):
-    r = Redis.create_client()
+async def front_admin_stg_code(request: Request, r: Redis = Depends(get_redis)):
     settings = get_settings()
-    stg_code = r.hget(f'{settings.redis_prefix}settings', 'stg_code')
+    stg_code = await r.hget(f'{settings.redis_prefix}settings', 'stg_code')
     flash(request, 'info', f'Stg Code为 {stg_code}')
     return RedirectResponse(url=request.app.url_path_for("front_admin_index"), status_code=303)
 
@@ -82,45 +86,38 @@ async def front_admin_stg_code(request: Request):
 
 # region feedback
 @router.get('/feedback', response_class=HTMLResponse)
-async def front_admin_feedback_get(request: Request):
-    r_fb = RedisFeedBack.create_client()
-    feedback_list = r_fb.keys('feedback|*')
-    return_list = []
-    for i in feedback_list:
-        temp_list = i.replace('feedback|', '').split('|')
-        return_list.append(temp_list)
-    return template.TemplateResponse("feedback_admin.html", {"request": request, "feedback_list": return_list})
+async def front_admin_feedback_get(request: Request, cursor: int | None = None, plugin: str = '', status: str = '',
+                                   r_fb: Redis = Depends(get_redis_feedback)):
+    feedback_keys, next_cursor = await page_feedback(r_fb, await resolve_feedback_index(r_fb, plugin, status), cursor)
+    return_list = [list(parse_feedback_key(key)) for key in feedback_keys]
+    return template.TemplateResponse("feedback_admin.html", {"request": request, "feedback_list": return_list, "next_cursor": next_cursor,
+                                                             "plugin": plugin, "status": status})
 
 
 @router.get('/feedback/export', response_class=HTMLResponse)
-async def front_admin_feedback_export_get(request: Request):
-    r_fb = RedisFeedBack.create_client()
-    feedback_list = r_fb.keys('feedback|*')
+async def front_admin_feedback_export_get(request: Request, cursor: int | None = None, r_fb: Redis = Depends(get_redis_feedback)):
+    feedback_keys, next_cursor = await page_feedback(r_fb, get_feedback_index(), cursor)
     return_dict = {}
-    for i in feedback_list:
-        dhash, plugin_name, order_id = i.replace('feedback|', '').split('|')
-        if plugin_name not in return_dict:
-            return_dict[plugin_name] = []
-        feedback = r_fb.hgetall(f'feedback|{dhash}|{plugin_name}|{order_id}')
-        create_time = datetime.fromtimestamp(float(feedback.get('create_time', 0)), tz=timezone(timedelta(hours=8))).strftime('%Y-%m-%d %H:%M:%S')
-        return_dict[plugin_name].append({
-            "order_id": order_id,
-            "dhash": dhash,
-            "version": feedback['version'],
-            "content": feedback['content'],
-            "exception": feedback['exception'],
-            "reporter": feedback['reporter'],
-            "create_time": create_time,
-        })
-    for k, v in return_dict.items():
-        return_dict[k] = sorted(v, key=lambda x: x['order_id'], reverse=True)
-    return template.TemplateResponse("feedback_export.html", {"request": request, "export_dict": return_dict})
+    for (key, feedback) in await load_feedback(r_fb, feedback_keys):
+        row = export_row(key, feedback)
+        return_dict.setdefault(row['plugin'], []).append(row)
+    return template.TemplateResponse("feedback_export.html", {"request": request, "export_dict": return_dict, "next_cursor": next_cursor})
+
+
+@router.get('/feedback/export/stream')
+async def front_admin_feedback_export_stream_get(format: Literal['ndjson', 'csv'] = 'ndjson', plugin: str = '', status: str = '',
+                                                 r_fb: Redis = Depends(get_redis_feedback)):
+    filename = f"feedback-{datetime.now(FEEDBACK_TZ).strftime('%Y%m%d%H%M%S')}.{format}"
+    media_type = 'text/csv; charset=utf-8' if format == 'csv' else 'application/x-ndjson'
+    index = await resolve_feedback_index(r_fb, plugin, status)
+    return StreamingResponse(stream_feedback_export(r_fb, index, format), media_type=media_type,
+                             headers={'Content-Disposition': f'attachment; filename="{filename}"'})
 
 
 @router.get('/feedback/detail/{plugin_name}/{feedback_id}', response_class=HTMLResponse)
-async def front_admin_feedback_detail_get(request: Request, plugin_name: str, feedback_id: int, dhash: str | None = None):
-    r_fb = RedisFeedBack.create_client()
-    feedback = r_fb.hgetall(f'feedback|{dhash}|{plugin_name}|{feedback_id}')
+async def front_admin_feedback_detail_get(request: Request, plugin_name: str, feedback_id: int, dhash: str | None = None,
+                                          r_fb: Redis = Depends(get_redis_feedback)):
+    feedback = await r_fb.hgetall(f'feedback|{dhash}|{plugin_name}|{feedback_id}')
     if not feedback:
         raise HTTPException(status_code=404, detail="Feedback not found")
     feedback['reply_log'] = json.loads(feedback['reply_log'])
@@ -129,19 +126,20 @@ async def front_admin_feedback_detail_get(request: Request, plugin_name: str, fe
 
 
 @router.get('/feedback/solve/{feedback_id}', response_class=RedirectResponse)
-async def front_admin_feedback_solve_get(request: Request, feedback_id: int, referer: str | None = None):
-    r_fb = RedisFeedBack.create_client()
-    feedback_list = r_fb.keys(f'feedback|*|{feedback_id}')
-    if len(feedback_list) == 1:
-        r_fb.delete(feedback_list[0])
-        if referer == "export":
-            return RedirectResponse(request.app.url_path_for('front_admin_feedback_export_get'))
-        else:
-            return RedirectResponse(request.app.url_path_for('front_admin_feedback_get'))
-    elif len(feedback_list) > 1:
-        raise HTTPException(status_code=400, detail="More than one feedback found.")
-    else:
+async def front_admin_feedback_solve_get(request: Request, feedback_id: int, referer: str | None = None,
+                                         r_fb: Redis = Depends(get_redis_feedback)):
+    feedback_key = await get_feedback_key_by_id(r_fb, feedback_id)
+    if not feedback_key:
         raise HTTPException(status_code=400, detail="No feedback found.")
+    status = await r_fb.hget(feedback_key, 'status')
+    async with r_fb.pipeline() as pipe:
+        pipe.delete(feedback_key)
+        unindex_feedback(pipe, feedback_key, status or 'open')
+        await pipe.execute()
+    if referer == "export":
+        return RedirectResponse(request.app.url_path_for('front_admin_feedback_export_get'))
+    else:
+        return RedirectResponse(request.app.url_path_for('front_admin_feedback_get'))
 
 
 @router.post('/feedback/reply/{feedback_id}', response_class=RedirectResponse)
@@ -228,4 +226,15 @@ async def front_admin_log_analytics_post(request: Request, file: UploadFile = Fo
     analysis_result, log_file_type = analysis(file, settings.plugin_api_level)
     return template.TemplateResponse("log_analysis_result.html", {"request": request, "analysis_result": analysis_result, "log_file_type": log_file_type})
 
+
+@router.get('/analytics/rollup')
+async def front_admin_analytics_rollup_get(day: str | None = Query(default=None, pattern=r'^\d{8}$'), days: int = 1, settings: Settings = Depends(get_settings),
+                                           r: Redis = Depends(get_redis)):
+    """Daily Dalamud start rollups (see ``analytics_aggregate``), ``day`` (YYYYMMDD) or the last ``days`` days."""
+    if day:
+        return [await load_rollup(r, day)]
+    if not 1 <= days <= settings.analytics_retention_days:
+        raise HTTPException(status_code=400, detail="Invalid days")
+    return [await load_rollup(r, get_analytics_day(i)) for i in range(days)]
+
 # endregion
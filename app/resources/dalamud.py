@@ -1,23 +1,25 @@
-import asyncio
 import hashlib
 import json
+import re
 
-import httpx
-import orjson
 from pydantic import BaseModel, Field
-from fastapi import APIRouter, HTTPException, Depends, Query, BackgroundTasks
+from redis.asyncio import Redis
+from fastapi import APIRouter, HTTPException, Depends, Query, BackgroundTasks, Request
 from fastapi.responses import RedirectResponse, PlainTextResponse
-from app.utils import httpx_client
+from logs import logger
 from app.config import Settings
-from app.utils.common import get_settings, get_tos_content, get_tos_hash
-from app.utils.redis import Redis
+from app.utils.common import DALAMUD_TRACKS, get_settings, get_tos_content, get_tos_hash
+from app.utils.analytics import aggregate_start, analytics_forwarder
+from app.utils.cache import read_cache
+from app.utils.redis import get_redis
+from app.utils.generations import PLUGIN_GENERATION, get_current_generation, versioned_key
+from app.utils.responses import hget_document
 
 from app.utils.tasks import regen
 
 router = APIRouter()
 
-api_secret = get_settings().ga_api_secret
-measurement_id = "G-W3HJPGVM1J"
+RUNTIME_VERSION_REGEX = re.compile(r'\d+\.\d+\.\d+(-[0-9A-Za-z.]+)?')
 
 
 class Analytics(BaseModel):
@@ -35,35 +37,36 @@ class Analytics(BaseModel):
 
 
 @router.get("/Asset/Meta")
-async def dalamud_assets(settings: Settings = Depends(get_settings)):
-    r = Redis.create_client()
-    asset_str = r.hget(f'{settings.redis_prefix}asset', 'meta')
-    if not asset_str:
+async def dalamud_assets(request: Request, settings: Settings = Depends(get_settings), r: Redis = Depends(get_redis)):
+    response = await hget_document(request, r, f'{settings.redis_prefix}asset', 'meta')
+    if not response:
         raise HTTPException(status_code=404, detail="Asset meta not found")
-    asset_json = json.loads(asset_str)
-    return asset_json
+    return response
 
 
 @router.get("/Release/VersionInfo")
-async def dalamud_release(settings: Settings = Depends(get_settings), track: str = "release"):
+async def dalamud_release(request: Request, settings: Settings = Depends(get_settings), r: Redis = Depends(get_redis), track: str = "release"):
     if track == "staging":
         track = "stg"
     if not track:
         track = "release"
-    r = Redis.create_client()
-    version_str = r.hget(f'{settings.redis_prefix}dalamud', f'dist-{track}')
-    if not version_str:
+    if track not in DALAMUD_TRACKS:
         raise HTTPException(status_code=400, detail="Invalid track")
-    version_json = json.loads(version_str)
-    return version_json
+    response = await hget_document(request, r, f'{settings.redis_prefix}dalamud', f'dist-{track}')
+    if not response:
+        raise HTTPException(status_code=400, detail="Invalid track")
+    return response
 
 
 @router.get("/Release/Meta")
-async def dalamud_release_meta(settings: Settings = Depends(get_settings)):
+async def dalamud_release_meta(request: Request, settings: Settings = Depends(get_settings), r: Redis = Depends(get_redis)):
+    response = await hget_document(request, r, f'{settings.redis_prefix}dalamud', 'meta')
+    if response:
+        return response
+    # Not regenerated since the combined meta document was introduced
     meta_json = {}
-    r = Redis.create_client()
-    for track in ['release', 'stg', 'canary']:
-        version_str = r.hget(f'{settings.redis_prefix}dalamud', f'dist-{track}')
+    version_strs = await read_cache.hmget(r, f'{settings.redis_prefix}dalamud', [f'dist-{track}' for track in DALAMUD_TRACKS])
+    for (track, version_str) in zip(DALAMUD_TRACKS, version_strs):
         if not version_str:
             continue
         version_json = json.loads(version_str)
@@ -72,11 +75,10 @@ async def dalamud_release_meta(settings: Settings = Depends(get_settings)):
 
 
 @router.get("/Release/Runtime/{kind_version:path}")
-async def dalamud_runtime(kind_version: str, settings: Settings = Depends(get_settings)):
+async def dalamud_runtime(kind_version: str, settings: Settings = Depends(get_settings), r: Redis = Depends(get_redis)):
     if len(kind_version.split('/')) != 2:
         return HTTPException(status_code=400, detail="Invalid path")
     kind, version = kind_version.split('/')
-    r = Redis.create_client()
     kind_map = {
         'WindowsDesktop': 'desktop',
         'DotNet': 'dotnet',
@@ -84,7 +86,9 @@ async def dalamud_runtime(kind_version: str, settings: Settings = Depends(get_se
     }
     if kind not in kind_map:
         raise HTTPException(status_code=400, detail="Invalid kind")
-    hashed_name = r.hget(f'{settings.redis_prefix}runtime', f'{kind_map[kind]}-{version}')
+    if not RUNTIME_VERSION_REGEX.fullmatch(version):
+        raise HTTPException(status_code=400, detail="Invalid version")
+    hashed_name = await read_cache.hget(r, f'{settings.redis_prefix}runtime', f'{kind_map[kind]}-{version}')
     if not hashed_name:
         raise HTTPException(status_code=400, detail="Invalid version")
     return RedirectResponse(f"/File/Get/{hashed_name}", status_code=302)
@@ -106,33 +110,25 @@ async def asset_clear_cache(background_tasks: BackgroundTasks, key: str = Query(
     return {'message': 'Background task was started.'}
 
 
-async def _analytics_post(url: str, payload: dict):
-    content = orjson.dumps(payload)
-    for attempt in range(3):
-        try:
-            resp = await httpx_client.post(
-                url,
-                content=content,
-                headers={"content-type": "application/json"},
-            )
-            return resp.status_code
-        except (httpx.RequestError, httpx.HTTPStatusError):
-            if attempt == 2:
-                return None
-            await asyncio.sleep(0.5 * (attempt + 1))
-
-
 @router.post("/Analytics/Start")
-async def analytics_start(analytics: Analytics, settings: Settings = Depends(get_settings)):
-    ga_url = f"https://www.google-analytics.com/mp/collect?measurement_id={measurement_id}&api_secret={api_secret}"
-    r = Redis.create_client()
-    cheatplugin_hash = r.hget(f'{settings.redis_prefix}asset', 'cheatplugin_hash')
-    cheatplugin_hash_sha256 = r.hget(f'{settings.redis_prefix}asset', 'cheatplugin_hash_sha256')
+async def analytics_start(analytics: Analytics, settings: Settings = Depends(get_settings), r: Redis = Depends(get_redis)):
+    # Both come from the per-worker read cache: the cheat hashes until the next asset regen, the known plugins
+    # as a frozenset per pluginmaster generation, so only the client's own list is walked per request.
+    cheatplugin_hash, cheatplugin_hash_sha256 = await read_cache.hmget(r, f'{settings.redis_prefix}asset',
+                                                                       ['cheatplugin_hash', 'cheatplugin_hash_sha256'])
     cheat_banned_hash_valid = analytics.cheat_banned_hash and \
                               (cheatplugin_hash == analytics.cheat_banned_hash or cheatplugin_hash_sha256 == analytics.cheat_banned_hash)
-    plugin_name_list = r.lrange(f'{settings.redis_prefix}plugin_name_list', 0, -1)
-    plugin_3rd_list = list(set(analytics.plugin_list) - set(plugin_name_list))
+    known_plugins = await read_cache.lrange(
+        r, versioned_key(f'{settings.redis_prefix}plugin_name_list', await get_current_generation(r, PLUGIN_GENERATION)),
+        decode=frozenset)
+    client_plugins = set(analytics.plugin_list)
+    plugin_3rd_list = list(client_plugins - known_plugins)
     user_id = hashlib.blake2s(analytics.user_id.encode(), digest_size=8).hexdigest()
+    if settings.analytics_aggregate:
+        try:
+            await aggregate_start(r, analytics, user_id, client_plugins & known_plugins, len(plugin_3rd_list))
+        except Exception as e:
+            logger.error(f"Analytics aggregation failed: {e}")
     user_props_base = {
         "HomeWorld": {"value": analytics.server_id},
         "Cheat_Banned_Hash_Valid": {"value": cheat_banned_hash_valid},
@@ -163,11 +159,7 @@ async def analytics_start(analytics: Analytics, settings: Settings = Depends(get
         },
         "events": [{"name": "start_dalamud", "params": event_params}],
     }
-
-    await asyncio.gather(
-        _analytics_post(ga_url, data_ga),
-        _analytics_post("http://127.0.0.1:7000/collect", data_oa),
-    )
+    analytics_forwarder.submit(data_ga, data_oa)  # sent in the background, batched with other starts
     return {'message': 'OK'}
 
 
@@ -185,8 +177,7 @@ class StgCode(BaseModel):
 
 
 @router.post("/Check/StgCode")
-async def check_stg_code(StgCode: StgCode, settings: Settings = Depends(get_settings)):
-    r = Redis.create_client()
-    if StgCode.code != r.hget(f'{settings.redis_prefix}settings', 'stg_code'):
+async def check_stg_code(StgCode: StgCode, settings: Settings = Depends(get_settings), r: Redis = Depends(get_redis)):
+    if StgCode.code != await read_cache.hget(r, f'{settings.redis_prefix}settings', 'stg_code'):
         raise HTTPException(status_code=400, detail="Invalid code")
     return {'message': 'OK'}
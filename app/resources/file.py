@@ -1,22 +1,41 @@
 import os
-import re
-from fastapi import APIRouter, HTTPException, Path
-from fastapi.responses import FileResponse
+from urllib.parse import quote
+
+from fastapi import APIRouter, HTTPException, Path, Depends, Request
+from fastapi.responses import FileResponse, Response
+
+from app.config import Settings
+from app.utils.common import get_settings
+from app.utils.file_index import FILENAME_REGEX, IndexedFile, file_index
+from app.utils.responses import etag_matches
 
 router = APIRouter()
 
-FILENAME_REGEX = r"(?P<name>.*?)\.(?P<hash>.{64})\.(?P<ext>.*)"
+
+def offload_response(indexed: IndexedFile, file_name: str, headers: dict, settings: Settings) -> Response:
+    """Empty response telling the reverse proxy which cached file to send (it then handles Range itself)."""
+    if settings.file_offload == 'x-accel-redirect':
+        headers['X-Accel-Redirect'] = f"{settings.file_offload_prefix.rstrip('/')}/{quote(file_name)}"
+    else:
+        headers['X-Sendfile'] = os.path.abspath(indexed.path)
+    if quote(indexed.clean_name) == indexed.clean_name:
+        headers['Content-Disposition'] = f'attachment; filename="{indexed.clean_name}"'
+    else:
+        headers['Content-Disposition'] = f"attachment; filename*=utf-8''{quote(indexed.clean_name)}"
+    return Response(media_type=indexed.media_type, headers=headers)
+
 
 @router.get("/Get/{file_name}")
-async def file_get(file_name: str = Path(regex=FILENAME_REGEX)):
-    cache_dir = os.getenv('CACHE_DIR', 'cache')
-    if not os.path.isdir(cache_dir):
-        os.mkdir(cache_dir)
-    match = re.match(FILENAME_REGEX, file_name)
-    if not match:
-        raise HTTPException(status_code=400, detail="File name format mismatch")
-    clean_file_name = f"{match.group('name')}.{match.group('ext')}"
-    file_path = os.path.join(cache_dir, file_name)
-    if not os.path.isfile(file_path):
+async def file_get(request: Request, file_name: str = Path(regex=FILENAME_REGEX), settings: Settings = Depends(get_settings)):
+    indexed = file_index.get(file_name)
+    if not indexed:
         raise HTTPException(status_code=404, detail="File not found")
-    return FileResponse(file_path, filename=clean_file_name)
+    headers = {'ETag': indexed.etag, 'Cache-Control': settings.file_cache_control}
+    if etag_matches(request, indexed.etag):
+        return Response(status_code=304, headers=headers)
+    if settings.file_offload:
+        return offload_response(indexed, file_name, headers, settings)
+    # FileResponse answers Range / If-Range (206, multipart for several ranges) and uses the ASGI pathsend
+    # extension where the server offers it, so only full bodies are streamed chunk by chunk.
+    return FileResponse(indexed.path, headers=headers, media_type=indexed.media_type, filename=indexed.clean_name,
+                        stat_result=indexed.stat_result)
@@ -3,10 +3,13 @@ from typing import Union
 
 from fastapi import APIRouter, HTTPException, Depends, Query, BackgroundTasks, Header
 from fastapi.responses import RedirectResponse
+from redis.asyncio import Redis
 
 from app.config import Settings
 from app.utils.common import get_settings
-from app.utils.redis import Redis
+from app.utils.cache import read_cache
+from app.utils.counters import counters
+from app.utils.redis import get_redis
 from app.utils.tasks import regen
 
 router = APIRouter()
@@ -24,20 +27,20 @@ async def launcher(
         x_xl_firststart: Union[str, None] = Header(default="no", regex=r"yes|no"),
         x_xl_havewine: Union[str, None] = Header(default="no", regex=r"yes|no"),
         accept: Union[str, None] = Header(default="*/*"),
-        settings: Settings = Depends(get_settings)
+        settings: Settings = Depends(get_settings),
+        r: Redis = Depends(get_redis)
 ):
-    r = Redis.create_client()
     if x_xl_track == 'Release':
         release_type = 'release'
     elif x_xl_track == 'Prerelease':
         release_type = 'prerelease'
     else:
         raise HTTPException(status_code=400, detail="Invalid track")
-    releases_list = r.hget(f'{settings.redis_prefix}xivlauncher', f'{release_type}-releaseslist')
+    releases_list = await read_cache.hget(r, f'{settings.redis_prefix}xivlauncher', f'{release_type}-releaseslist')
 
     if x_xl_firststart == 'yes' or not x_xl_haveversion:
-        r.hincrby(f'{settings.redis_prefix}xivlauncher-count', 'XLUniqueInstalls')
-    r.hincrby(f'{settings.redis_prefix}xivlauncher-count', 'XLStarts')
+        counters.incr(f'{settings.redis_prefix}xivlauncher-count', 'XLUniqueInstalls')
+    counters.incr(f'{settings.redis_prefix}xivlauncher-count', 'XLStarts')
 
     return {
         "success": True,
@@ -60,16 +63,16 @@ async def launcher_file(
         x_xl_firststart: Union[str, None] = Header(default="no", regex=r"yes|no"),
         x_xl_havewine: Union[str, None] = Header(default="no", regex=r"yes|no"),
         accept: Union[str, None] = Header(default="*/*"),
-        settings: Settings = Depends(get_settings)
+        settings: Settings = Depends(get_settings),
+        r: Redis = Depends(get_redis)
 ):
-    r = Redis.create_client()
     if x_xl_track == 'Release':
         release_type = 'release'
     elif x_xl_track == 'Prerelease':
         release_type = 'prerelease'
     else:
         raise HTTPException(status_code=400, detail="Invalid track")
-    tag_name = r.hget(f'{settings.redis_prefix}xivlauncher', f'{release_type}-tag')
+    tag_name = await read_cache.hget(r, f'{settings.redis_prefix}xivlauncher', f'{release_type}-tag')
     valid_files = [
         'Setup.exe',
         f'XIVLauncherCN-{tag_name}-delta.nupkg',
@@ -78,8 +81,10 @@ async def launcher_file(
         f'XIVLauncher-{tag_name}-full.nupkg',
         'CHANGELOG.txt'
     ]
-    hashed_name = r.hget(f'{settings.redis_prefix}xivlauncher', f'{release_type}-{file}')
-    if file not in valid_files or not hashed_name:
+    if file not in valid_files:
+        raise HTTPException(status_code=400, detail="Invalid file name")
+    hashed_name = await read_cache.hget(r, f'{settings.redis_prefix}xivlauncher', f'{release_type}-{file}')
+    if not hashed_name:
         raise HTTPException(status_code=400, detail="Invalid file name")
     return RedirectResponse(f"/File/Get/{hashed_name}", status_code=302)
 
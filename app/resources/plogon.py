@@ -1,8 +1,9 @@
 from app.config import Settings
 from app.utils.common import get_settings
-from app.utils.redis import Redis
+from app.utils.redis import get_redis
 from app.utils.auth import check_auth
 from fastapi import APIRouter, HTTPException, Depends
+from redis.asyncio import Redis
 
 
 router = APIRouter()
@@ -14,18 +15,17 @@ async def register_message_id(
     prNumber: str,
     messageId: str,
     settings: Settings = Depends(get_settings),
+    r: Redis = Depends(get_redis),
 ):
     if not check_auth(key):
         raise HTTPException(status_code=401, detail="Unauthorized")
-    r = Redis.create_client()
-    r.rpush(f'{settings.redis_prefix}plogon|MSGS-{prNumber}', messageId)
+    await r.rpush(f'{settings.redis_prefix}plogon|MSGS-{prNumber}', messageId)
     return {'message': 'OK'}
 
 
 @router.get("/GetMessageIds")
-async def get_message_ids(prNumber: str, settings: Settings = Depends(get_settings)):
-    r = Redis.create_client()
-    ids = r.lrange(f'{settings.redis_prefix}plogon|MSGS-{prNumber}', 0, -1) or []
+async def get_message_ids(prNumber: str, settings: Settings = Depends(get_settings), r: Redis = Depends(get_redis)):
+    ids = await r.lrange(f'{settings.redis_prefix}plogon|MSGS-{prNumber}', 0, -1) or []
     return ids
 
 
@@ -36,17 +36,16 @@ async def register_version_pr_number(
     version: str,
     prNumber: str,
     settings: Settings = Depends(get_settings),
+    r: Redis = Depends(get_redis),
 ):
     if not check_auth(key):
         raise HTTPException(status_code=401, detail="Unauthorized")
-    r = Redis.create_client()
-    r.hset(f'{settings.redis_prefix}plogon|CHANGELOG', f"{internalName}-{version}", prNumber)
+    await r.hset(f'{settings.redis_prefix}plogon|CHANGELOG', f"{internalName}-{version}", prNumber)
     return {'message': 'OK'}
 
 @router.get("/GetVersionChangelog")
-async def get_version_changelog(internalName: str, version: str, settings: Settings = Depends(get_settings)):
-    r = Redis.create_client()
-    pr_number = r.hget(f'{settings.redis_prefix}plogon|CHANGELOG', f"{internalName}-{version}")
+async def get_version_changelog(internalName: str, version: str, settings: Settings = Depends(get_settings), r: Redis = Depends(get_redis)):
+    pr_number = await r.hget(f'{settings.redis_prefix}plogon|CHANGELOG', f"{internalName}-{version}")
     if not pr_number:
         raise HTTPException(status_code=404, detail="Not Found")
     return pr_number
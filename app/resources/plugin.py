@@ -1,22 +1,32 @@
 import re
 import json
 import time
+from redis.asyncio import Redis
 from app.config import Settings
-from app.utils import httpx_client
 from app.utils.common import get_settings, get_apilevel_namespace_map
-from app.utils.responses import PrettyJSONResponse
-from app.utils.redis import Redis, RedisFeedBack
+from app.utils.responses import PrettyJSONResponse, split_pluginmaster_fragments, render_pluginmaster, combine_etags, etag_matches, \
+    not_modified, document_response, hget_document, apply_pluginmaster_translations, dump_pluginmaster_fragment
+from app.utils.cache import read_cache
+from app.utils.counters import counters
+from app.utils.feedback import enqueue_feedback_notification, get_feedback_key, index_feedback
+from app.utils.generations import PLUGIN_GENERATION, get_current_generation, versioned_key
+from app.utils.compression import negotiate_encoding, compress
+from app.utils.redis import get_redis, get_redis_feedback
 from app.utils.tasks import regen
-from fastapi import APIRouter, HTTPException, Depends, Query, BackgroundTasks
+from fastapi import APIRouter, HTTPException, Depends, Query, BackgroundTasks, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import RedirectResponse
 from pydantic import BaseModel
 
 router = APIRouter()
 
+# (plugin namespace, encoding) -> (etag, encoded body), last compressed PluginMaster of this worker
+_encoded_pluginmaster: dict[tuple[str, str], tuple[str, bytes]] = {}
+
 
 @router.get("/Download/{plugin}")
-async def plugin_download(plugin: str, isUpdate: bool = False, isTesting: bool = False, branch: str = '', settings: Settings = Depends(get_settings)):
-    r = Redis.create_client()
+async def plugin_download(plugin: str, isUpdate: bool = False, isTesting: bool = False, branch: str = '',
+                          settings: Settings = Depends(get_settings), r: Redis = Depends(get_redis)):
     try:
         api_level = re.search(r'api(?P<level>\d+)', branch).group('level')
     except AttributeError:
@@ -30,56 +40,74 @@ async def plugin_download(plugin: str, isUpdate: bool = False, isTesting: bool =
         return HTTPException(status_code=400, detail="API level not supported")
     plugin_namespace = apilevel_namespace_map[api_level]
     plugin_name = plugin + '-testing' if isTesting else plugin
-    plugin_hashed_name = r.hget(f'{settings.redis_prefix}{plugin_namespace}', plugin_name)
+    namespace_key = versioned_key(f'{settings.redis_prefix}{plugin_namespace}', await get_current_generation(r, PLUGIN_GENERATION))
+    plugin_hashed_name = await read_cache.hget(r, namespace_key, plugin_name)
     if not plugin_hashed_name and isTesting:  # use stable if testing not exists
-        plugin_hashed_name = r.hget(f'{settings.redis_prefix}{plugin_namespace}', plugin)
+        plugin_hashed_name = await read_cache.hget(r, namespace_key, plugin)
     if not plugin_hashed_name:
         raise HTTPException(status_code=404, detail="Plugin not found")
-    r.hincrby(f'{settings.redis_prefix}plugin-count', plugin)
-    r.hincrby(f'{settings.redis_prefix}plugin-count', 'accumulated')
+    counters.incr(f'{settings.redis_prefix}plugin-count', plugin)
+    counters.incr(f'{settings.redis_prefix}plugin-count', 'accumulated')
     return RedirectResponse(f"/File/Get/{plugin_hashed_name}", status_code=302)
 
 
+async def _load_legacy_pluginmaster(r, settings, namespace_key: str) -> tuple[list[str], list[tuple[str, str]]]:
+    """Fragments rendered from the plain ``pluginmaster`` document, for namespaces not regenerated since
+    fragments were introduced. Translated per request, as the endpoint used to."""
+    pluginmaster = await read_cache.hget(r, namespace_key, 'pluginmaster', decode=json.loads)
+    if not pluginmaster:
+        return [], []
+    if settings.default_pm_lang != 'en-US':
+        (desc_str, punchline_str) = await r.hmget(f'{settings.redis_prefix}crowdin', [
+            f'plugin-description-{settings.default_pm_lang}', f'plugin-punchline-{settings.default_pm_lang}'])
+        pluginmaster = apply_pluginmaster_translations(pluginmaster, json.loads(desc_str or '{}'), json.loads(punchline_str or '{}'))
+    return split_pluginmaster_fragments([dump_pluginmaster_fragment(plugin) for plugin in pluginmaster])
+
+
 @router.get("/PluginMaster", response_class=PrettyJSONResponse)
-async def pluginmaster(apiLevel: int = 0, settings: Settings = Depends(get_settings)):
-    r = Redis.create_client()
+async def pluginmaster(request: Request, apiLevel: int = 0, settings: Settings = Depends(get_settings), r: Redis = Depends(get_redis)):
     if not apiLevel:
         apiLevel = settings.plugin_api_level
     apilevel_namespace_map = get_apilevel_namespace_map()
     if apiLevel not in apilevel_namespace_map:
         return HTTPException(status_code=400, detail="API level not supported")
     plugin_namespace = apilevel_namespace_map[apiLevel]
-    pluginmaster_str = r.hget(f'{settings.redis_prefix}{plugin_namespace}', 'pluginmaster')
-    if not pluginmaster_str:
+    generation = await get_current_generation(r, PLUGIN_GENERATION)
+    # The accumulated counter moves with every download, so it versions the live counts spliced below.
+    fragments_etag = await read_cache.hget(r, versioned_key(f'{settings.redis_prefix}{plugin_namespace}', generation),
+                                           'pluginmaster-fragments-etag')
+    accumulated = await r.hget(f'{settings.redis_prefix}plugin-count', 'accumulated')
+    etag = combine_etags(fragments_etag, accumulated or 0)
+    encoding = negotiate_encoding(request)
+    if fragments_etag and etag_matches(request, etag):
+        return not_modified(etag, encoding)
+    # Counts make the body per-request, so instead of regen-time variants the last encoded body is kept until the ETag moves.
+    encoded = _encoded_pluginmaster.get((plugin_namespace, encoding))
+    if encoding and encoded and encoded[0] == etag:
+        return document_response(encoded[1], etag, media_type=PrettyJSONResponse.media_type, encoding=encoding)
+    # Entries are pre-serialized (and translated) by regen_pluginmaster, only the download counts are live.
+    plugin_names, parts = await read_cache.lrange(
+        r, versioned_key(f'{settings.redis_prefix}{plugin_namespace}|pluginmaster-fragments', generation),
+        decode=split_pluginmaster_fragments)
+    if not parts:
+        plugin_names, parts = await _load_legacy_pluginmaster(
+            r, settings, versioned_key(f'{settings.redis_prefix}{plugin_namespace}', generation))
+    if not parts:
         raise HTTPException(status_code=404, detail="Pluginmaster not found")
-    pluginmaster = json.loads(pluginmaster_str)
-    translations = {}
-    if settings.default_pm_lang != 'en-US':
-        desc_str = r.hget(f'{settings.redis_prefix}crowdin', f'plugin-description-{settings.default_pm_lang}') or '{}'
-        punchline_str = r.hget(f'{settings.redis_prefix}crowdin', f'plugin-punchline-{settings.default_pm_lang}') or '{}'
-        translations = {
-            'description': json.loads(desc_str),
-            'punchline': json.loads(punchline_str)
-        }
-    # print(translations)
-    for plugin in pluginmaster:
-        plugin_name = plugin['InternalName']
-        download_count = r.hget(f'{settings.redis_prefix}plugin-count', plugin_name) or 0
-        plugin["DownloadCount"] = int(download_count)
-        if translations:
-            plugin['Description'] = translations['description'].get(plugin_name, plugin.get('Description'))
-            plugin['Punchline'] = translations['punchline'].get(plugin_name, plugin.get('Punchline'))
-    return pluginmaster
+    download_counts = await r.hmget(f'{settings.redis_prefix}plugin-count', plugin_names)
+    content = render_pluginmaster(parts, download_counts)
+    if encoding:
+        content = await run_in_threadpool(compress, content, encoding, 'dynamic')
+        _encoded_pluginmaster[(plugin_namespace, encoding)] = (etag, content)
+    return document_response(content, etag, media_type=PrettyJSONResponse.media_type, encoding=encoding)
 
 
 @router.get("/CoreChangelog")
-async def core_changelog(settings: Settings = Depends(get_settings)):
-    r = Redis.create_client()
-    changelog_str = r.hget(f'{settings.redis_prefix}dalamud', 'changelog')
-    if not changelog_str:
+async def core_changelog(request: Request, settings: Settings = Depends(get_settings), r: Redis = Depends(get_redis)):
+    response = await hget_document(request, r, f'{settings.redis_prefix}dalamud', 'changelog')
+    if not response:
         return []
-    changelog = json.loads(changelog_str)
-    return changelog
+    return response
 
 
 @router.post("/ClearCache")
@@ -108,9 +136,8 @@ class FeedBack(BaseModel):
 
 
 @router.post('/Feedback')
-async def feedback(feedback: FeedBack, settings: Settings = Depends(get_settings)):
-    r = Redis.create_client()
-    r_fb = RedisFeedBack.create_client()
+async def feedback(feedback: FeedBack, settings: Settings = Depends(get_settings),
+                   r: Redis = Depends(get_redis), r_fb: Redis = Depends(get_redis_feedback)):
     reporter = feedback.reporter
     # if not re.match(r'^[a-zA-Z0-9_-]+@[a-zA-Z0-9_-]+(\.[a-zA-Z0-9_-]+)+$', email):
     #     email = ''
@@ -131,10 +158,15 @@ async def feedback(feedback: FeedBack, settings: Settings = Depends(get_settings
         'reply_log': json.dumps([]),  # 回复记录
         'create_time': time.time()
     }
-    order_id = r.incr(f'{settings.redis_prefix}feedback-order-id')  # 自增生成唯一id
-    r_fb.hincrby(f'{settings.redis_prefix}feedback-count', name)  # 记录每个插件现有的反馈数
-    r_fb.hmset(f'feedback|{dhash}|{name}|{order_id}', feedback_dict)
-    await httpx_client.post('https://xn--v9x.net/dalamud/feedback', json={'content': content, 'name': name, 'dhash': dhash, 'version': version, 'reporter': reporter})
+    order_id = await r.incr(f'{settings.redis_prefix}feedback-order-id')  # 自增生成唯一id
+    feedback_key = get_feedback_key(dhash, name, order_id)
+    async with r_fb.pipeline() as pipe:  # the feedback, its index entries and its outbox record are written together
+        pipe.hincrby(f'{settings.redis_prefix}feedback-count', name)  # 记录每个插件现有的反馈数
+        pipe.hset(feedback_key, mapping=feedback_dict)
+        index_feedback(pipe, feedback_key, feedback_dict['status'])
+        # delivered to the webhook by the outbox dispatcher, the request only waits on Redis
+        enqueue_feedback_notification(pipe, {'content': content, 'name': name, 'dhash': dhash, 'version': version, 'reporter': reporter})
+        await pipe.execute()
     return {'message': 'Feedback was submitted.', 'status': 'success', 'order_id': order_id}
 
 
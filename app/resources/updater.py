@@ -7,10 +7,13 @@ import json
 from typing import Union
 from app.config import Settings
 from app.utils.common import get_settings
-from app.utils.redis import Redis
+from app.utils.cache import read_cache
+from app.utils.redis import get_redis
+from app.utils.responses import combine_etags, etag_matches, not_modified, cache_headers
 from app.utils.tasks import regen
-from fastapi import APIRouter, HTTPException, Depends, Query, BackgroundTasks, Header
-from fastapi.responses import RedirectResponse,PlainTextResponse
+from fastapi import APIRouter, HTTPException, Depends, Query, BackgroundTasks, Header, Request
+from fastapi.responses import RedirectResponse,PlainTextResponse, Response
+from redis.asyncio import Redis
 from datetime import datetime, timedelta
 
 router = APIRouter()
@@ -20,20 +23,27 @@ SEMVER_REGEX = r"^(0|[1-9]\d*)\.(0|[1-9]\d*)\.(0|[1-9]\d*)(\.(0|[1-9]\d*))?(?:-(
 
 @router.get("/Release/VersionInfo")
 async def updater_version_info(
+        request: Request,
+        response: Response,
         user_agent: Union[str, None] = Header(default="Injector"),
         accept: Union[str, None] = Header(default="*/*"),
         x_updater_track: Union[str, None] = Header(default="Release"),
-        settings: Settings = Depends(get_settings)
+        settings: Settings = Depends(get_settings),
+        r: Redis = Depends(get_redis)
 ):
-    r = Redis.create_client()
     if x_updater_track == 'Release':
         release_type = 'release'
     elif x_updater_track == 'Prerelease':
         release_type = 'prerelease'
     else:
         raise HTTPException(status_code=400, detail="Invalid track")
-    hashed_name = r.hget(f'{settings.redis_prefix}updater', f'{release_type}-asset')
-    version_dict = json.loads(r.hget(f'{settings.redis_prefix}updater', 'version'))
+    hashed_name, version_etag = await read_cache.hmget(r, f'{settings.redis_prefix}updater', [f'{release_type}-asset', 'version-etag'])
+    etag = combine_etags(release_type, hashed_name, version_etag, settings.updater_safe_mode)
+    if version_etag and etag_matches(request, etag):
+        return not_modified(etag)
+    version_dict = await read_cache.hget(r, f'{settings.redis_prefix}updater', 'version', decode=json.loads)
+    if version_etag:
+        response.headers.update(cache_headers(etag))
     # if x_xl_firststart == 'yes' or not x_xl_haveversion:
     #     r.hincrby(f'{settings.redis_prefix}xivlauncher-count', 'XLUniqueInstalls')
     # r.hincrby(f'{settings.redis_prefix}xivlauncher-count', 'XLStarts')
@@ -55,9 +65,8 @@ async def clear_cache(background_tasks: BackgroundTasks, key: str = Query(), set
 
 
 @router.get("/Download")
-async def updater_download(settings: Settings = Depends(get_settings)):
-    r = Redis.create_client()
-    hashed_name = r.hget(f'{settings.redis_prefix}updater', 'release-asset')
+async def updater_download(settings: Settings = Depends(get_settings), r: Redis = Depends(get_redis)):
+    hashed_name = await read_cache.hget(r, f'{settings.redis_prefix}updater', 'release-asset')
     return RedirectResponse(f"/File/Get/{hashed_name}", status_code=302)
 
 
@@ -3,10 +3,14 @@ import json
 from typing import Union
 from app.config import Settings
 from app.utils.common import get_settings
-from app.utils.redis import Redis
+from app.utils.cache import read_cache
+from app.utils.counters import counters
+from app.utils.redis import get_redis
+from app.utils.responses import combine_etags, etag_matches, not_modified, cache_headers, hget_document
 from app.utils.tasks import regen
-from fastapi import APIRouter, HTTPException, Depends, Query, BackgroundTasks
-from fastapi.responses import RedirectResponse, PlainTextResponse
+from fastapi import APIRouter, HTTPException, Depends, Query, BackgroundTasks, Request
+from fastapi.responses import RedirectResponse, PlainTextResponse, Response
+from redis.asyncio import Redis
 
 router = APIRouter()
 
@@ -14,37 +18,40 @@ SEMVER_REGEX = r"^(0|[1-9]\d*)\.(0|[1-9]\d*)\.(0|[1-9]\d*)(\.(0|[1-9]\d*))?(?:-(
 
 
 @router.get("/Meta")
-async def xivlauncher_meta(settings: Settings = Depends(get_settings)):
-    r = Redis.create_client()
-    release_meta_str = r.hget(f'{settings.redis_prefix}xivlauncher', 'release-meta')
-    release_meta = json.loads(release_meta_str) if release_meta_str else {}
-    prerelease_meta_str = r.hget(f'{settings.redis_prefix}xivlauncher', 'prerelease-meta')
-    prerelease_meta = json.loads(prerelease_meta_str) if prerelease_meta_str else {}
-    total_downloads = r.hget(f'{settings.redis_prefix}xivlauncher-count', 'XLStarts') or 0
-    unique_installs = r.hget(f'{settings.redis_prefix}xivlauncher-count', 'XLUniqueInstalls') or 0
+async def xivlauncher_meta(request: Request, response: Response, settings: Settings = Depends(get_settings), r: Redis = Depends(get_redis)):
+    meta_etags = await read_cache.hmget(r, f'{settings.redis_prefix}xivlauncher', ['release-meta-etag', 'prerelease-meta-etag'])
+    total_downloads, unique_installs = await r.hmget(f'{settings.redis_prefix}xivlauncher-count', ['XLStarts', 'XLUniqueInstalls'])
+    total_downloads = total_downloads or 0
+    unique_installs = unique_installs or 0
+    etag = combine_etags(*meta_etags, total_downloads, unique_installs)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    release_meta, prerelease_meta = await read_cache.hmget(r, f'{settings.redis_prefix}xivlauncher', ['release-meta', 'prerelease-meta'],
+                                                          decode=json.loads)
     version_info = {
         'totalDownloads': int(total_downloads),
         'uniqueInstalls': int(unique_installs),
-        'releaseVersion': release_meta,
-        'prereleaseVersion': prerelease_meta,
+        'releaseVersion': release_meta or {},
+        'prereleaseVersion': prerelease_meta or {},
     }
+    response.headers.update(cache_headers(etag))
     return version_info
 
 
 @router.get("/Update/{track_file:path}")
-async def xivlauncher(track_file: str, localVersion: Union[str, None] = None, settings: Settings = Depends(get_settings)):
+async def xivlauncher(track_file: str, localVersion: Union[str, None] = None,
+                      settings: Settings = Depends(get_settings), r: Redis = Depends(get_redis)):
     if len(track_file.split('/')) != 2:
         return HTTPException(status_code=400, detail="Invalid path")
     track, file = track_file.split('/')
-    r = Redis.create_client()
     if localVersion:
         if not re.match(SEMVER_REGEX, localVersion):
             raise HTTPException(status_code=400, detail="Invalid local version")
         if (file == "RELEASES"):
-            r.hincrby(f'{settings.redis_prefix}xivlauncher-count', 'XLStarts')
+            counters.incr(f'{settings.redis_prefix}xivlauncher-count', 'XLStarts')
     else:
         if (file == "RELEASES"):
-            r.hincrby(f'{settings.redis_prefix}xivlauncher-count', 'XLUniqueInstalls')
+            counters.incr(f'{settings.redis_prefix}xivlauncher-count', 'XLUniqueInstalls')
     if track == 'Release':
         release_type = 'release'
     elif track == 'Prerelease':
@@ -53,9 +60,9 @@ async def xivlauncher(track_file: str, localVersion: Union[str, None] = None, se
         raise HTTPException(status_code=400, detail="Invalid track")
 
     if file == 'RELEASES':
-        releases_list = r.hget(f'{settings.redis_prefix}xivlauncher', f'{release_type}-releaseslist')
+        releases_list = await read_cache.hget(r, f'{settings.redis_prefix}xivlauncher', f'{release_type}-releaseslist')
         return PlainTextResponse(releases_list)
-    tag_name = r.hget(f'{settings.redis_prefix}xivlauncher', f'{release_type}-tag')
+    tag_name = await read_cache.hget(r, f'{settings.redis_prefix}xivlauncher', f'{release_type}-tag')
 
     valid_files = [
         'Setup.exe',
@@ -65,21 +72,23 @@ async def xivlauncher(track_file: str, localVersion: Union[str, None] = None, se
         f'XIVLauncher-{tag_name}-full.nupkg',
         'CHANGELOG.txt'
     ]
-    hashed_name = r.hget(f'{settings.redis_prefix}xivlauncher', f'{release_type}-{file}')
-    if file not in valid_files or not hashed_name:
+    if file not in valid_files:
+        raise HTTPException(status_code=400, detail="Invalid file name")
+    hashed_name = await read_cache.hget(r, f'{settings.redis_prefix}xivlauncher', f'{release_type}-{file}')
+    if not hashed_name:
         raise HTTPException(status_code=400, detail="Invalid file name")
     return RedirectResponse(f"/File/Get/{hashed_name}", status_code=302)
 
 
 @router.get("/XLAssets/integrity/{ff_client_version}.json")
-async def xivlauncher_assets(ff_client_version: str, settings: Settings = Depends(get_settings)):
-    r = Redis.create_client()
-    assets_version = r.hget(f'{settings.redis_prefix}xlassets', 'version')
+async def xivlauncher_assets(request: Request, ff_client_version: str, settings: Settings = Depends(get_settings), r: Redis = Depends(get_redis)):
+    assets_version = await read_cache.hget(r, f'{settings.redis_prefix}xlassets', 'version')
+    response = None
     if ff_client_version == assets_version:
-        result = r.hget(f'{settings.redis_prefix}xlassets', 'json')
-        return json.loads(result)
-    else:
+        response = await hget_document(request, r, f'{settings.redis_prefix}xlassets', 'json')
+    if not response:
         raise HTTPException(status_code=404, detail="XLAssets not found")
+    return response
 
 
 @router.post("/ClearCache")
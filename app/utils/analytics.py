@@ -0,0 +1,261 @@
+import asyncio
+from datetime import datetime, timezone, timedelta
+from typing import Optional
+
+import httpx
+import orjson
+
+from logs import logger
+from . import httpx_client
+from .cache import read_cache
+from .common import DALAMUD_TRACKS, get_settings
+from .counters import counters
+from .spool import Spool, register_spool
+
+ANALYTICS_TZ = timezone(timedelta(hours=8))  # same day boundary as the admin pages
+MAX_VALUE_LENGTH = 64
+OTHER_VALUE = 'other'  # rollup bucket of client-supplied values outside the known set
+ANALYTICS_OS = {'windows': 'Windows', 'wine': 'Wine', 'linux': 'Linux', 'macos': 'macOS'}
+MAX_SERVER_ID = 0xFFFF  # world ids are ushort
+
+GA_MEASUREMENT_ID = "G-W3HJPGVM1J"
+GA_MAX_EVENTS = 25  # per Measurement Protocol request, which also carries a single client_id / user
+COLLECTOR_URL = "http://127.0.0.1:7000/collect"
+
+
+def get_analytics_day(days_ago: int = 0) -> str:
+    return (datetime.now(ANALYTICS_TZ) - timedelta(days=days_ago)).strftime('%Y%m%d')
+
+
+def _rollup_keys(day: str) -> tuple[str, str]:
+    prefix = f'{get_settings().redis_prefix}analytics|{day}'
+    # <prefix>|starts is a hash of "total" and "<dimension>|<value>" counters,
+    # <prefix>|users[|<dimension>|<value>] are HyperLogLogs of hashed user ids.
+    return f'{prefix}|starts', f'{prefix}|users'
+
+
+def _dimension_value(value) -> str:
+    return str(value)[:MAX_VALUE_LENGTH].replace('|', '_')
+
+
+def _decode_assembly_version(version_str: str) -> str | None:
+    return orjson.loads(version_str).get('AssemblyVersion')
+
+
+async def _get_dalamud_versions(r) -> frozenset[str]:
+    """Assembly versions currently distributed on any track, from the read cache (as their own entries,
+    the same fields are served raw by /Dalamud/Release/VersionInfo)."""
+    versions = await read_cache.hmget(r, f'{get_settings().redis_prefix}dalamud', [f'dist-{track}' for track in DALAMUD_TRACKS],
+                                      decode=_decode_assembly_version)
+    return frozenset(version for version in versions if version)
+
+
+def _server_id_value(server_id: str) -> str:
+    return str(int(server_id)) if server_id.isdecimal() and int(server_id) <= MAX_SERVER_ID else OTHER_VALUE
+
+
+async def aggregate_start(r, analytics, user_id: str, known_plugins: set[str], third_party_count: int):
+    """Record one Dalamud start in today's rollup, in a single pipeline.
+
+    Every dimension is client-supplied, so only known values are counted as such (our own plugins,
+    distributed Dalamud versions, world ids, known OSes), anything else goes to ``other``, the
+    rollup would otherwise grow without bound. Third-party plugins are only counted.
+    """
+    settings = get_settings()
+    starts_key, users_key = _rollup_keys(get_analytics_day())
+    ttl = settings.analytics_retention_days * 86400
+    dalamud_versions = await _get_dalamud_versions(r)
+    dimensions = {
+        'dalamud_version': analytics.dalamud_version if analytics.dalamud_version in dalamud_versions else OTHER_VALUE,
+        'server_id': _server_id_value(analytics.server_id),
+        'os': ANALYTICS_OS.get(analytics.os.lower(), OTHER_VALUE),
+        'is_testing': analytics.is_testing,
+        'has_3rd_party': third_party_count > 0,
+    }
+    fields = [f'{dimension}|{_dimension_value(value)}' for (dimension, value) in dimensions.items()]
+    fields += [f'plugin|{_dimension_value(plugin)}' for plugin in sorted(known_plugins)]
+    async with r.pipeline(transaction=False) as pipe:
+        pipe.hincrby(starts_key, 'total')
+        pipe.pfadd(users_key, user_id)
+        pipe.expire(starts_key, ttl)
+        pipe.expire(users_key, ttl)
+        for field in fields:
+            pipe.hincrby(starts_key, field)
+            pipe.pfadd(f'{users_key}|{field}', user_id)
+            pipe.expire(f'{users_key}|{field}', ttl)
+        await pipe.execute()
+
+
+async def load_rollup(r, day: str) -> dict:
+    starts_key, users_key = _rollup_keys(day)
+    starts = await r.hgetall(starts_key)
+    fields = sorted(field for field in starts if field != 'total')
+    async with r.pipeline(transaction=False) as pipe:
+        pipe.pfcount(users_key)
+        for field in fields:
+            pipe.pfcount(f'{users_key}|{field}')
+        users = await pipe.execute()
+    rollup = {'day': day, 'starts': int(starts.get('total', 0)), 'users': users[0], 'dimensions': {}}
+    for (field, unique_users) in zip(fields, users[1:]):
+        dimension, _, value = field.partition('|')
+        rollup['dimensions'].setdefault(dimension, {})[value] = {'starts': int(starts[field]), 'users': unique_users}
+    return rollup
+
+
+def _get_ga_url() -> str:
+    return f"https://www.google-analytics.com/mp/collect?measurement_id={GA_MEASUREMENT_ID}&api_secret={get_settings().ga_api_secret}"
+
+
+async def _post(url: str, content: bytes, attempts: int = 3) -> bool:
+    """False when the target is unreachable or answers 5xx, a 4xx would not succeed on retry either."""
+    for attempt in range(attempts):
+        try:
+            resp = await httpx_client.post(url, content=content, headers={"content-type": "application/json"})
+            if resp.status_code < 500:
+                return True
+        except httpx.RequestError:
+            pass
+        if attempt < attempts - 1:
+            await asyncio.sleep(0.5 * (attempt + 1))
+    return False
+
+
+async def _replay_ga(payload: dict) -> bool:
+    return await _post(_get_ga_url(), orjson.dumps(payload), attempts=1)
+
+
+async def _replay_collector(payload: dict) -> bool:
+    return await _post(COLLECTOR_URL, orjson.dumps(payload), attempts=1)
+
+
+ga_spool = register_spool('ga', _replay_ga)
+collector_spool = register_spool('collector', _replay_collector)
+
+
+def _merge_ga_payloads(payloads: list[dict]) -> list[dict]:
+    """Merge payloads that differ only in their events, GA batches events of one client / user only."""
+    merged: dict[bytes, dict] = {}
+    for payload in payloads:
+        key = orjson.dumps({k: v for (k, v) in payload.items() if k != 'events'}, option=orjson.OPT_SORT_KEYS)
+        if key in merged:
+            merged[key]['events'].extend(payload['events'])
+        else:
+            merged[key] = {**payload, 'events': list(payload['events'])}
+    requests = []
+    for payload in merged.values():
+        for i in range(0, len(payload['events']), GA_MAX_EVENTS):
+            requests.append({**payload, 'events': payload['events'][i:i + GA_MAX_EVENTS]})
+    return requests
+
+
+class AnalyticsForwarder():
+    """Per-worker background sender of /Dalamud/Analytics/Start events to GA and the local collector.
+
+    Requests only enqueue (``submit``); a worker drains up to ``analytics_batch_size`` events at a time,
+    waiting at most ``analytics_batch_delay`` seconds for a batch to fill. Sends that still fail after
+    retries go to the target's spool; events are dropped, and counted in the ``analytics-dropped`` hash,
+    when the queue is full or spooling is off.
+    """
+
+    def __init__(self):
+        self.queue: Optional[asyncio.Queue] = None
+        self.worker: Optional[asyncio.Task] = None
+        self.in_flight: list[tuple[dict, dict]] = []
+
+    def submit(self, ga_payload: dict, collector_payload: dict) -> bool:
+        if self.queue is None:
+            self._drop('not_running')
+            return False
+        try:
+            self.queue.put_nowait((ga_payload, collector_payload))
+            return True
+        except asyncio.QueueFull:
+            self._drop('queue_full')
+            return False
+
+    def _drop(self, reason: str, amount: int = 1):
+        counters.incr(f'{get_settings().redis_prefix}analytics-dropped', reason, amount)
+
+    async def _take_batch(self) -> list[tuple[dict, dict]]:
+        """Events are collected in ``in_flight`` so ``stop`` can still send them if the worker is cancelled."""
+        settings = get_settings()
+        loop = asyncio.get_running_loop()
+        self.in_flight.append(await self.queue.get())
+        deadline = loop.time() + settings.analytics_batch_delay
+        while len(self.in_flight) < settings.analytics_batch_size:
+            if self.queue.empty():
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    self.in_flight.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            else:
+                self.in_flight.append(self.queue.get_nowait())
+        return self.in_flight
+
+    async def _deliver(self, spool: Spool, url: str, payload: dict | list, events: int):
+        """Send ``payload``, spooling it when the target fails or is known to be failing."""
+        if not spool.is_down():
+            if await _post(url, orjson.dumps(payload)):
+                return
+            spool.mark_down()
+        for item in (payload if isinstance(payload, list) else [payload]):
+            if not spool.append(item):
+                self._drop(f'{spool.name}_failed', events)
+                return
+
+    async def send(self, batch: list[tuple[dict, dict]]):
+        settings = get_settings()
+        ga_requests = _merge_ga_payloads([ga_payload for (ga_payload, _) in batch])
+        collector_payloads = [collector_payload for (_, collector_payload) in batch]
+        size = max(1, settings.analytics_collector_batch_size)
+        collector_requests = collector_payloads if size == 1 else \
+            [collector_payloads[i:i + size] for i in range(0, len(collector_payloads), size)]
+        ga_url = _get_ga_url()
+        await asyncio.gather(
+            *[self._deliver(ga_spool, ga_url, payload, len(payload['events'])) for payload in ga_requests],
+            *[self._deliver(collector_spool, COLLECTOR_URL, payload, len(payload) if size > 1 else 1)
+              for payload in collector_requests],
+        )
+
+    async def _run(self):
+        while True:
+            batch = await self._take_batch()
+            try:
+                await self.send(batch)
+            except Exception as e:
+                logger.error(f"Forwarding {len(batch)} analytics events failed: {e}")
+                self._drop('error', len(batch))
+            self.in_flight = []
+
+    async def start(self):
+        if self.worker is None:
+            self.queue = asyncio.Queue(maxsize=get_settings().analytics_queue_size)
+            self.worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the worker and send what is still queued, events not sent in time are counted as dropped."""
+        if self.worker is None:
+            return
+        self.worker.cancel()
+        try:
+            await self.worker
+        except asyncio.CancelledError:
+            pass
+        self.worker = None
+        (queue, self.queue) = (self.queue, None)
+        (batch, self.in_flight) = (self.in_flight, [])
+        while not queue.empty():
+            batch.append(queue.get_nowait())
+        if not batch:
+            return
+        try:
+            await asyncio.wait_for(self.send(batch), get_settings().analytics_drain_timeout)
+        except Exception as e:
+            logger.error(f"Sending {len(batch)} queued analytics events on shutdown failed: {e!r}")
+            self._drop('shutdown', len(batch))
+
+
+analytics_forwarder = AnalyticsForwarder()
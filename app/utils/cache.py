@@ -0,0 +1,151 @@
+import asyncio
+import itertools
+import time
+from typing import Callable, Optional
+
+from logs import logger
+from .common import get_settings
+from .redis import AsyncRedis
+
+
+def get_invalidation_channel() -> str:
+    return f'{get_settings().redis_prefix}cache-invalidate'
+
+
+def invalidate_cache(redis_client, *keys: str):
+    """Called by regen tasks (sync client) after writing ``keys``, drops them from every worker's read cache.
+
+    Pass the task's transactional pipeline so the invalidations go out with the writes they describe.
+    """
+    channel = get_invalidation_channel()
+    for key in keys:
+        redis_client.publish(channel, key)
+
+
+class ReadCache():
+    """Per-worker cache of regen-published Redis data, keyed by (key, field, decode).
+
+    Values are stored after ``decode`` so hot paths skip both the round-trip and the parsing; callers
+    reading the same field with another (or no) decoder get their own entry.
+    Entries are dropped when a regen task publishes the key on the invalidation channel;
+    ``read_cache_ttl`` bounds staleness should a message ever be missed. Misses are cached too, so
+    the cache holds at most ``read_cache_max_entries``, least recently used first out.
+    """
+
+    def __init__(self):
+        self.entries: dict[tuple[str, Optional[str], Optional[Callable]], tuple[float, object]] = {}
+        self.versions: dict[str, int] = {}  # bumped on invalidation, guards against storing a value read before it
+        self.listener: Optional[asyncio.Task] = None
+        self.subscribed = False  # only cache while invalidations can reach us
+
+    def _get(self, key: str, field: Optional[str], decode: Optional[Callable]):
+        entry = self.entries.get((key, field, decode))
+        if entry is None:
+            return None
+        (expires_at, value) = entry
+        del self.entries[(key, field, decode)]
+        if expires_at < time.monotonic():
+            return None
+        self.entries[(key, field, decode)] = entry  # most recently used last
+        return entry
+
+    def _set(self, key: str, field: Optional[str], decode: Optional[Callable], value, version: int):
+        if not self.subscribed or self.versions.get(key, 0) != version:
+            return
+        if len(self.entries) >= get_settings().read_cache_max_entries:
+            self._evict()
+        self.entries[(key, field, decode)] = (time.monotonic() + get_settings().read_cache_ttl, value)
+
+    def _evict(self):
+        """Drop expired entries, then the least recently used ones down to 90% of the limit."""
+        now = time.monotonic()
+        for cache_key in [k for (k, (expires_at, _)) in self.entries.items() if expires_at < now]:
+            del self.entries[cache_key]
+        excess = len(self.entries) - int(get_settings().read_cache_max_entries * 0.9)
+        for cache_key in list(itertools.islice(self.entries, max(excess, 0))):
+            del self.entries[cache_key]
+
+    async def hget(self, r, key: str, field: str, decode: Optional[Callable] = None):
+        return (await self.hmget(r, key, [field], decode))[0]
+
+    async def hmget(self, r, key: str, fields: list[str], decode: Optional[Callable] = None) -> list:
+        cached = [self._get(key, field, decode) for field in fields]
+        missing = [field for (field, entry) in zip(fields, cached) if entry is None]
+        loaded = {}
+        if missing:
+            version = self.versions.get(key, 0)
+            values = await r.hmget(key, missing)
+            for (field, value) in zip(missing, values):
+                if value is not None and decode:
+                    value = decode(value)
+                loaded[field] = value
+                self._set(key, field, decode, value, version)
+        return [loaded[field] if entry is None else entry[1] for (field, entry) in zip(fields, cached)]
+
+    async def get(self, r, key: str, decode: Optional[Callable] = None):
+        entry = self._get(key, None, decode)
+        if entry is not None:
+            return entry[1]
+        version = self.versions.get(key, 0)
+        value = await r.get(key)
+        if value is not None and decode:
+            value = decode(value)
+        self._set(key, None, decode, value, version)
+        return value
+
+    async def lrange(self, r, key: str, decode: Optional[Callable] = None):
+        entry = self._get(key, None, decode)
+        if entry is not None:
+            return entry[1]
+        version = self.versions.get(key, 0)
+        value = await r.lrange(key, 0, -1)
+        if decode:
+            value = decode(value)
+        self._set(key, None, decode, value, version)
+        return value
+
+    def invalidate(self, key: str):
+        self.versions[key] = self.versions.get(key, 0) + 1
+        for cache_key in [x for x in self.entries if x[0] == key]:
+            del self.entries[cache_key]
+
+    def clear(self):
+        for key in list(self.versions):
+            self.versions[key] += 1
+        self.entries.clear()
+
+    async def _listen(self):
+        channel = get_invalidation_channel()
+        while True:
+            pubsub = AsyncRedis.get_client().pubsub()
+            try:
+                await pubsub.subscribe(channel)
+                self.subscribed = True
+                while True:
+                    message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                    if message and message['type'] == 'message':
+                        self.invalidate(message['data'])
+            except Exception as e:
+                logger.error(f"Read cache invalidation listener failed: {e}")
+            finally:
+                self.subscribed = False
+                self.clear()  # anything published while we were not subscribed is lost
+                await pubsub.aclose()
+            await asyncio.sleep(1)
+
+    async def start(self):
+        if get_settings().read_cache_ttl > 0 and self.listener is None:
+            self.listener = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self.listener is None:
+            return
+        self.listener.cancel()
+        try:
+            await self.listener
+        except asyncio.CancelledError:
+            pass
+        self.listener = None
+
+
+read_cache = ReadCache()
@@ -1,15 +1,28 @@
 import codecs
+import concurrent.futures
 import hashlib
+import json
 import os
 import re
 import shutil
+import sys
+import threading
 from functools import cache
 from urllib.parse import unquote, urlparse
 
 import requests
+import requests.adapters
+
+try:
+    import fcntl
+    import resource
+except ImportError:  # Windows
+    fcntl = None
+    resource = None
 
 from logs import logger
 from ..config import Settings
+from .file_index import file_index
 
 
 DOWNLOAD_HEADERS = {
@@ -20,6 +33,9 @@ DOWNLOAD_HEADERS = {
     ),
 }
 
+FICLONE = 0x40049409  # ioctl from linux/fs.h, reflink on btrfs / xfs
+DALAMUD_TRACKS = ('release', 'stg', 'canary')
+
 
 @cache
 def get_settings():
@@ -51,27 +67,208 @@ def get_tos_hash():
     return tos_hash
 
 
-def cache_file(file_path: str):
+def _reflink(src: str, dst: str) -> bool:
+    if fcntl is None:
+        return False
+    try:
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        return True
+    except OSError:  # not supported by the filesystem, or across filesystems
+        if os.path.exists(dst):
+            os.remove(dst)
+        return False
+
+
+def _hardlink(src: str, dst: str) -> bool:
+    try:
+        os.link(src, dst)
+        return True
+    except OSError:  # across filesystems, or not supported
+        return False
+
+
+def _tmp_path(path: str) -> str:
+    """Unique sibling of ``path`` for write-then-rename, regen tasks run in several threads and processes."""
+    return f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+
+
+def hash_file(file_path: str) -> str:
+    """sha256 hex digest of ``file_path``, read in ``file_hash_chunk_size`` chunks so memory stays bounded."""
+    sha256 = hashlib.sha256()
+    buffer = bytearray(get_settings().file_hash_chunk_size)
+    view = memoryview(buffer)
+    with open(file_path, "rb", buffering=0) as f:
+        while size := f.readinto(buffer):
+            sha256.update(view[:size])
+    return sha256.hexdigest()
+
+
+def link_cache_object(src: str, dst: str) -> str | None:
+    """Make ``dst`` share the data of ``src`` without copying: a reflink (copy-on-write clone), else a
+    hardlink unless ``file_cache_hardlink`` is off. Returns the method used, None if neither works."""
+    if _reflink(src, dst):
+        return 'reflink'
+    if get_settings().file_cache_hardlink and _hardlink(src, dst):
+        return 'hardlink'
+    return None
+
+
+def _file_identity(file_stat: os.stat_result) -> dict:
+    return {'size': file_stat.st_size, 'mtime_ns': file_stat.st_mtime_ns, 'ino': file_stat.st_ino}
+
+
+def load_file_hash(redis_client, file_path: str, file_stat: os.stat_result) -> str | None:
+    """sha256 recorded for ``file_path`` by a previous cache_file, if the file still has the same identity."""
+    entry = redis_client.hget(f'{get_settings().redis_prefix}file-hash-index', os.path.abspath(file_path))
+    if not entry:
+        return None
+    entry = json.loads(entry)
+    if {k: entry.get(k) for k in ('size', 'mtime_ns', 'ino')} != _file_identity(file_stat):
+        return None
+    return entry['sha256']
+
+
+def save_file_hash(redis_client, file_path: str, file_stat: os.stat_result, sha256_hash: str, hashed_name: str):
+    entry = {**_file_identity(file_stat), 'sha256': sha256_hash, 'hashed_name': hashed_name}
+    redis_client.hset(f'{get_settings().redis_prefix}file-hash-index', os.path.abspath(file_path), json.dumps(entry))
+
+
+def cache_file(file_path: str, redis_client=None):
+    """Store ``file_path`` in the content-addressed file cache, returns ``(hashed_name, hashed_path)``.
+
+    With ``redis_client``, hashes are remembered by file identity (path, size, mtime, inode) and
+    unchanged files are not read again.
+    """
     settings = get_settings()
     file_cache_dir = os.path.join(settings.root_path, settings.file_cache_dir)
     if not os.path.exists(file_cache_dir):
         os.makedirs(file_cache_dir, exist_ok=True)
+    # Objects are linked under a temp name before hashing, so the hash is read from exactly the data that
+    # gets renamed into place and linked sources are read only once.
+    tmp_path = _tmp_path(os.path.join(file_cache_dir, os.path.basename(file_path)))
+    method = None
     try:
-        with open(file_path, "rb") as f:
-            bs = f.read()
+        file_stat = os.stat(file_path)
+        sha256_hash = load_file_hash(redis_client, file_path, file_stat) if redis_client else None
+        hashed = sha256_hash is None
+        if hashed:
+            method = link_cache_object(file_path, tmp_path)
+            sha256_hash = hash_file(tmp_path if method else file_path)
     except FileNotFoundError:
         logger.error("File not found: " + file_path)
         return None
-    sha256_hash = hashlib.sha256(bs).hexdigest()
     s = re.search(r'(?P<name>[^/\\&\?]+)\.(?P<ext>\w+)', file_path)
     hashed_name = f"{s.group('name')}.{sha256_hash}.{s.group('ext')}"
     hashed_path = os.path.join(file_cache_dir, hashed_name)
-    logger.info(f"Caching {file_path} -> {hashed_path}")
-    shutil.copy(file_path, hashed_path)
+    try:
+        # The name is content-addressed, an existing object of the right size is already this content
+        if os.path.isfile(hashed_path) and os.path.getsize(hashed_path) == file_stat.st_size:
+            logger.debug(f"Cached {file_path} -> {hashed_path} exists, skipping")
+        else:
+            if not method:
+                method = link_cache_object(file_path, tmp_path)
+            if not method:
+                shutil.copyfile(file_path, tmp_path)
+                method = 'copy'
+            os.replace(tmp_path, hashed_path)
+            logger.info(f"Caching {file_path} -> {hashed_path} ({method})")
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    if redis_client and hashed:
+        save_file_hash(redis_client, file_path, file_stat, sha256_hash, hashed_name)
+    file_index.add(hashed_name, hashed_path)
     return hashed_name, hashed_path
 
 
+def get_peak_rss() -> int | None:
+    """Peak resident set size of this process in bytes (high-water mark since start), None where unsupported."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024  # kilobytes on Linux
+
+
+@cache
+def get_download_session() -> requests.Session:
+    """Shared session so regen downloads reuse connections, sized for ``download_concurrency`` threads."""
+    settings = get_settings()
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=settings.download_concurrency,
+                                            pool_maxsize=settings.download_concurrency)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update(DOWNLOAD_HEADERS)
+    return session
+
+
+@cache
+def _download_lock(filepath: str) -> threading.Lock:
+    return threading.Lock()
+
+
+def _load_download_meta(meta_path: str, url: str) -> dict:
+    try:
+        with open(meta_path, 'r') as f:
+            meta = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+    return meta if meta.get('url') == url else {}
+
+
+def _save_download_meta(meta_path: str, meta: dict):
+    tmp_path = _tmp_path(meta_path)
+    with open(tmp_path, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, meta_path)
+
+
+def _download(url: str, filepath: str, timeout: float) -> bool:
+    """One attempt, returns False if the file was not modified. Resumes ``<file>.part`` when its validator still holds."""
+    settings = get_settings()
+    part_path = f"{filepath}.part"
+    meta_path = f"{filepath}.download.json"  # validators of the complete file, or of the response being written to .part
+    meta = _load_download_meta(meta_path, url)
+    validator = meta.get('etag') or meta.get('last_modified')
+    headers = {}
+    offset = 0
+    if meta.get('complete') and os.path.exists(filepath):
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+    elif validator and os.path.exists(part_path):
+        offset = os.path.getsize(part_path)
+        headers['Range'] = f'bytes={offset}-'
+        headers['If-Range'] = validator
+    with get_download_session().get(url, stream=True, timeout=timeout, headers=headers) as r:
+        if r.status_code == 304:
+            return False
+        if r.status_code == 416:  # stale part
+            os.remove(part_path)
+            raise requests.exceptions.RetryError(f"Range not satisfiable for {url}, restarting")
+        r.raise_for_status()
+        if r.status_code != 206:
+            offset = 0
+            meta = {'url': url, 'etag': r.headers.get('ETag'), 'last_modified': r.headers.get('Last-Modified'), 'complete': False}
+            _save_download_meta(meta_path, meta)
+        logger.info(f"Downloading {url} -> {filepath}" + (f" (resuming at {offset} bytes)" if offset else ""))
+        with open(part_path, 'ab' if offset else 'wb') as f:
+            for chunk in r.iter_content(chunk_size=settings.download_chunk_size):
+                f.write(chunk)
+    # Rename into place, the old file may be hardlinked into the cache by cache_file
+    os.replace(part_path, filepath)
+    _save_download_meta(meta_path, {**meta, 'complete': True})
+    return True
+
+
 def download_file(url, dst="", force: bool = False, filename: str = "", timeout: float = 60):
+    """Download ``url`` into ``dst`` (the file cache by default) and return the local path.
+
+    An existing file is kept unless ``force``; forced downloads are conditional on the stored
+    ETag / Last-Modified. Interrupted transfers are resumed with a Range request.
+    """
     settings = get_settings()
     file_cache_dir = os.path.join(settings.root_path, settings.file_cache_dir)
     if not dst:
@@ -83,13 +280,25 @@ def download_file(url, dst="", force: bool = False, filename: str = "", timeout:
     if not local_filename:
         raise RuntimeError(f"Cannot infer file name from url: {url}")
     filepath = os.path.join(dst, local_filename)
-    if os.path.exists(filepath) and not force:
-        logger.info(f"File {filepath} exists, skipping download")
-        return filepath
-    logger.info(f"Downloading {url} -> {filepath}")
-    with requests.get(url, stream=True, timeout=timeout, headers=DOWNLOAD_HEADERS) as r:
-        r.raise_for_status()
-        with open(filepath, 'wb') as f:
-            for chunk in r.iter_content(chunk_size=8192):
-                f.write(chunk)
-    return filepath
+    with _download_lock(os.path.abspath(filepath)):
+        if os.path.exists(filepath) and not force:
+            logger.info(f"File {filepath} exists, skipping download")
+            return filepath
+        for attempt in range(settings.download_retries + 1):
+            try:
+                if not _download(url, filepath, timeout):
+                    logger.info(f"File {filepath} not modified, skipping download")
+                return filepath
+            except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError,
+                    requests.exceptions.Timeout, requests.exceptions.RetryError) as e:
+                if attempt == settings.download_retries:
+                    raise
+                logger.warning(f"Downloading {url} failed ({e}), retrying")
+
+
+def download_files(urls: list[str], dst="", force: bool = False, filenames: list[str] | None = None,
+                   timeout: float = 60) -> list[str]:
+    """``download_file`` for several urls, ``download_concurrency`` at a time. Paths are returned in order."""
+    filenames = filenames or [""] * len(urls)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=get_settings().download_concurrency) as executor:
+        return list(executor.map(lambda item: download_file(item[0], dst, force, item[1], timeout), zip(urls, filenames)))
@@ -0,0 +1,118 @@
+import gzip
+from typing import Optional
+
+import brotli
+import zstandard
+from fastapi import Request
+from starlette.datastructures import Headers
+from starlette.middleware.gzip import GZipMiddleware, GZipResponder
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# Server preference when the client accepts several encodings
+ENCODINGS = ('br', 'zstd', 'gzip')
+
+# 'static' is used once per regen for stored variants, 'dynamic' for bodies built per request
+COMPRESSION_LEVELS = {
+    'static': {'br': 11, 'zstd': 19, 'gzip': 9},
+    'dynamic': {'br': 5, 'zstd': 3, 'gzip': 6},
+}
+
+
+def compress(content: bytes, encoding: str, mode: str = 'static') -> bytes:
+    level = COMPRESSION_LEVELS[mode][encoding]
+    if encoding == 'br':
+        return brotli.compress(content, quality=level)
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=level).compress(content)
+    if encoding == 'gzip':
+        return gzip.compress(content, compresslevel=level, mtime=0)
+    raise ValueError(f"Unsupported encoding: {encoding}")
+
+
+def parse_accept_encoding(accept_encoding: str) -> dict[str, float]:
+    accepted = {}
+    for item in accept_encoding.lower().split(','):
+        coding, _, params = item.strip().partition(';')
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[coding.strip()] = q
+    return accepted
+
+
+def accepts_encoding(accept_encoding: str, encoding: str) -> bool:
+    accepted = parse_accept_encoding(accept_encoding)
+    return accepted.get(encoding, accepted.get('*', 0.0)) > 0
+
+
+def negotiate_encoding(request: Request) -> Optional[str]:
+    """Pick the preferred encoding from Accept-Encoding, honouring q=0 exclusions."""
+    accept_encoding = request.headers.get('accept-encoding', '')
+    if not accept_encoding:
+        return None
+    for encoding in ENCODINGS:
+        if accepts_encoding(accept_encoding, encoding):
+            return encoding
+    return None
+
+
+def variant_etag(etag: str, encoding: Optional[str]) -> str:
+    """Strong validators must differ per representation, so encoded variants get a suffix."""
+    if not encoding:
+        return etag
+    return f'{etag[:-1]}-{encoding}"'
+
+
+def base_etag(etag: str) -> str:
+    for encoding in ENCODINGS:
+        suffix = f'-{encoding}"'
+        if etag.endswith(suffix):
+            return etag[:-len(suffix)] + '"'
+    return etag
+
+
+class PolicyGZipResponder(GZipResponder):
+    def __init__(self, app: ASGIApp, minimum_size: int, compresslevel: int, excluded_media_types: tuple[str, ...]) -> None:
+        super().__init__(app, minimum_size, compresslevel=compresslevel)
+        self.excluded_media_types = excluded_media_types
+
+    async def send_with_compression(self, message: Message) -> None:
+        await super().send_with_compression(message)
+        if message["type"] == "http.response.start":
+            content_type = Headers(raw=message["headers"]).get("content-type", "")
+            if content_type.startswith(self.excluded_media_types):
+                self.content_type_is_excluded = True
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """GZipMiddleware that leaves binary / already-compressed responses alone.
+
+    Requests under ``excluded_prefixes`` or whose path ends with one of ``excluded_extensions`` are passed
+    through untouched (so file bodies stream straight from disk), and responses whose Content-Type starts
+    with one of ``excluded_media_types`` are never compressed.
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int = 500, compresslevel: int = 9,
+                 excluded_prefixes: tuple[str, ...] = (), excluded_extensions: tuple[str, ...] = (),
+                 excluded_media_types: tuple[str, ...] = ()) -> None:
+        super().__init__(app, minimum_size=minimum_size, compresslevel=compresslevel)
+        self.excluded_prefixes = tuple(x.lower() for x in excluded_prefixes)
+        self.excluded_extensions = tuple(x.lower() for x in excluded_extensions)
+        self.excluded_media_types = tuple(excluded_media_types)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":  # pragma: no cover
+            await self.app(scope, receive, send)
+            return
+        path = scope["path"].lower()
+        accept_encoding = Headers(scope=scope).get("Accept-Encoding", "")
+        if path.startswith(self.excluded_prefixes) or path.endswith(self.excluded_extensions) \
+                or not accepts_encoding(accept_encoding, "gzip"):
+            await self.app(scope, receive, send)
+            return
+        responder = PolicyGZipResponder(self.app, self.minimum_size, self.compresslevel, self.excluded_media_types)
+        await responder(scope, receive, send)
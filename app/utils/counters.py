@@ -0,0 +1,71 @@
+import asyncio
+from collections import defaultdict
+from typing import Optional
+
+from logs import logger
+from .common import get_settings
+from .redis import AsyncRedis
+
+
+class CounterBuffer():
+    """Per-worker aggregator for HINCRBY counters (download / launch counts).
+
+    Increments are summed in memory and written in one pipeline every ``counter_flush_interval``
+    seconds, or as soon as ``counter_flush_count`` increments are pending. The lifespan flushes
+    whatever is left on shutdown.
+    """
+
+    def __init__(self):
+        self.pending: defaultdict[tuple[str, str], int] = defaultdict(int)
+        self.pending_count = 0
+        self.wakeup = asyncio.Event()
+        self.flusher: Optional[asyncio.Task] = None
+
+    def incr(self, key: str, field: str, amount: int = 1):
+        self.pending[(key, field)] += amount
+        self.pending_count += 1
+        if self.pending_count >= get_settings().counter_flush_count:
+            self.wakeup.set()
+
+    async def flush(self):
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, defaultdict(int)
+        self.pending_count = 0
+        try:
+            async with AsyncRedis.get_client().pipeline(transaction=False) as pipe:
+                for ((key, field), amount) in pending.items():
+                    pipe.hincrby(key, field, amount)
+                await pipe.execute()
+        except Exception as e:
+            logger.error(f"Flushing {len(pending)} counters failed, keeping them for the next flush: {e}")
+            for (counter, amount) in pending.items():
+                self.pending[counter] += amount
+
+    async def _run(self):
+        interval = get_settings().counter_flush_interval
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            await self.flush()
+
+    async def start(self):
+        if self.flusher is None:
+            self.wakeup = asyncio.Event()  # bind to the running loop
+            self.flusher = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.flusher is not None:
+            self.flusher.cancel()
+            try:
+                await self.flusher
+            except asyncio.CancelledError:
+                pass
+            self.flusher = None
+        await self.flush()
+
+
+counters = CounterBuffer()
@@ -5,6 +5,7 @@ import codecs
 from .common import get_settings
 from crowdin_api import CrowdinClient
 from .redis import Redis
+from .tasks import regen
 
 class Crowdin():
     config = get_settings()
@@ -79,3 +80,5 @@ class Crowdin():
             punchline = json.load(f)
         r.hset(f'{self.config.redis_prefix}crowdin', f'plugin-description-{lang}', json.dumps(desc))
         r.hset(f'{self.config.redis_prefix}crowdin', f'plugin-punchline-{lang}', json.dumps(punchline))
+        # the pluginmaster fragments are translated at regen time, republish them with the new translations
+        regen(['plugin_translations'])
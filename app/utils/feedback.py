@@ -0,0 +1,337 @@
+import asyncio
+import csv
+import io
+import os
+import socket
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, Optional
+
+import httpx
+import orjson
+import redis.exceptions
+
+from logs import logger
+from . import httpx_client
+from .common import get_settings
+from .redis import AsyncRedis
+
+FEEDBACK_WEBHOOK_URL = 'https://xn--v9x.net/dalamud/feedback'
+OUTBOX_GROUP = 'dispatcher'
+
+
+def get_feedback_outbox() -> str:
+    return f'{get_settings().redis_prefix}feedback-outbox'
+
+
+def get_feedback_dead_letters() -> str:
+    return f'{get_settings().redis_prefix}feedback-outbox-dead'
+
+
+def enqueue_feedback_notification(pipe, payload: dict):
+    """Queue the webhook notification on ``pipe``, in the same transaction as the feedback it announces."""
+    settings = get_settings()
+    pipe.xadd(get_feedback_outbox(), {'payload': orjson.dumps(payload)},
+              maxlen=settings.feedback_outbox_maxlen, approximate=True)
+
+
+async def _send_feedback(payload: dict) -> bool:
+    try:
+        resp = await httpx_client.post(FEEDBACK_WEBHOOK_URL, json=payload, timeout=get_settings().feedback_webhook_timeout)
+    except httpx.RequestError as e:
+        logger.warning(f"Feedback webhook failed: {e!r}")
+        return False
+    if resp.status_code >= 500:
+        logger.warning(f"Feedback webhook answered {resp.status_code}")
+        return False
+    return True  # a 4xx would not succeed on retry either
+
+
+class FeedbackDispatcher():
+    """Per-worker consumer of the feedback outbox stream (consumer group ``dispatcher``).
+
+    New entries are read with XREADGROUP and posted ``feedback_outbox_concurrency`` at a time, delivered
+    ones are acked and deleted. Failed entries stay pending; once idle for ``feedback_outbox_retry_interval``
+    seconds any worker claims them again (this also picks up entries of dead workers). After
+    ``feedback_outbox_max_attempts`` deliveries an entry is moved to the dead-letter stream.
+
+    Each worker is its own consumer, removed from the group on shutdown once it has nothing pending;
+    consumers of crashed workers are removed when they have been idle for ten retry intervals.
+    """
+
+    def __init__(self):
+        self.worker: Optional[asyncio.Task] = None
+        self.consumer: Optional[str] = None
+
+    async def _remove_consumer(self, r_fb, consumer: str):
+        """XGROUP DELCONSUMER drops the consumer's pending entries too, so only empty consumers are removed."""
+        if not await r_fb.xpending_range(get_feedback_outbox(), OUTBOX_GROUP, min='-', max='+', count=1, consumername=consumer):
+            await r_fb.xgroup_delconsumer(get_feedback_outbox(), OUTBOX_GROUP, consumer)
+
+    async def _prune_consumers(self, r_fb):
+        idle = int(get_settings().feedback_outbox_retry_interval * 10 * 1000)
+        for consumer in await r_fb.xinfo_consumers(get_feedback_outbox(), OUTBOX_GROUP):
+            if consumer['name'] != self.consumer and consumer['pending'] == 0 and consumer['idle'] > idle:
+                await self._remove_consumer(r_fb, consumer['name'])
+
+    async def _ensure_group(self, r_fb):
+        try:
+            await r_fb.xgroup_create(get_feedback_outbox(), OUTBOX_GROUP, id='0', mkstream=True)
+        except redis.exceptions.ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+
+    async def _deliver(self, r_fb, messages: list[tuple[str, dict]]):
+        semaphore = asyncio.Semaphore(get_settings().feedback_outbox_concurrency)
+
+        async def deliver(fields: dict) -> bool:
+            async with semaphore:
+                return await _send_feedback(orjson.loads(fields['payload']))
+
+        results = await asyncio.gather(*[deliver(fields) for (_, fields) in messages])
+        delivered = [message_id for ((message_id, _), ok) in zip(messages, results) if ok]
+        if delivered:
+            async with r_fb.pipeline() as pipe:
+                pipe.xack(get_feedback_outbox(), OUTBOX_GROUP, *delivered)
+                pipe.xdel(get_feedback_outbox(), *delivered)
+                await pipe.execute()
+
+    async def _retry_pending(self, r_fb):
+        settings = get_settings()
+        idle = int(settings.feedback_outbox_retry_interval * 1000)
+        pending = await r_fb.xpending_range(get_feedback_outbox(), OUTBOX_GROUP, min='-', max='+',
+                                            count=settings.feedback_outbox_concurrency * 4, idle=idle)
+        if not pending:
+            return
+        dead = [p['message_id'] for p in pending if p['times_delivered'] >= settings.feedback_outbox_max_attempts]
+        retry = [p['message_id'] for p in pending if p['times_delivered'] < settings.feedback_outbox_max_attempts]
+        if dead:
+            # claiming first makes sure only one worker dead-letters them, only what we claimed is ours to remove
+            claimed = await r_fb.xclaim(get_feedback_outbox(), OUTBOX_GROUP, self.consumer, idle, dead)
+            claimed_ids = [message_id for (message_id, _) in claimed]
+            dead_letters = [(message_id, fields) for (message_id, fields) in claimed if fields]  # else dropped by MAXLEN meanwhile
+            if claimed_ids:
+                async with r_fb.pipeline() as pipe:
+                    for (message_id, fields) in dead_letters:
+                        pipe.xadd(get_feedback_dead_letters(), {**fields, 'id': message_id})
+                    pipe.xack(get_feedback_outbox(), OUTBOX_GROUP, *claimed_ids)
+                    pipe.xdel(get_feedback_outbox(), *claimed_ids)
+                    await pipe.execute()
+            if dead_letters:
+                logger.error(f"Moved {len(dead_letters)} feedback notifications to {get_feedback_dead_letters()} "
+                             f"after {settings.feedback_outbox_max_attempts} attempts")
+        if retry:
+            claimed = await r_fb.xclaim(get_feedback_outbox(), OUTBOX_GROUP, self.consumer, idle, retry)
+            trimmed = [message_id for (message_id, fields) in claimed if not fields]  # dropped by MAXLEN meanwhile
+            if trimmed:
+                await r_fb.xack(get_feedback_outbox(), OUTBOX_GROUP, *trimmed)
+            await self._deliver(r_fb, [(message_id, fields) for (message_id, fields) in claimed if fields])
+
+    async def _run(self):
+        settings = get_settings()
+        r_fb = AsyncRedis.get_client(1)
+        loop = asyncio.get_running_loop()
+        group_ready = False
+        next_retry = 0.0
+        while True:
+            try:
+                if not group_ready:
+                    await self._ensure_group(r_fb)
+                    group_ready = True
+                if loop.time() >= next_retry:
+                    next_retry = loop.time() + settings.feedback_outbox_retry_interval / 2
+                    await self._retry_pending(r_fb)
+                    await self._prune_consumers(r_fb)
+                entries = await r_fb.xreadgroup(OUTBOX_GROUP, self.consumer, {get_feedback_outbox(): '>'},
+                                                count=settings.feedback_outbox_concurrency, block=1000)
+                for (_, messages) in entries or []:
+                    await self._deliver(r_fb, messages)
+            except redis.exceptions.ResponseError as e:
+                if 'NOGROUP' in str(e):  # stream or group removed, e.g. by a flush
+                    group_ready = False
+                    continue
+                logger.error(f"Feedback outbox dispatcher failed: {e}")
+                await asyncio.sleep(1)
+            except Exception as e:
+                logger.error(f"Feedback outbox dispatcher failed: {e}")
+                await asyncio.sleep(1)
+
+    async def start(self):
+        if self.worker is None:
+            # named here rather than at import, with preload_app that would be the master's pid in every worker
+            self.consumer = f'{socket.gethostname()}-{os.getpid()}'
+            self.worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Entries still being delivered stay pending and are claimed again by a running worker."""
+        if self.worker is None:
+            return
+        self.worker.cancel()
+        try:
+            await self.worker
+        except asyncio.CancelledError:
+            pass
+        self.worker = None
+        try:
+            await self._remove_consumer(AsyncRedis.get_client(1), self.consumer)
+        except Exception as e:
+            logger.error(f"Removing feedback outbox consumer {self.consumer} failed: {e}")
+
+
+feedback_dispatcher = FeedbackDispatcher()
+
+
+# Feedback hashes live in the feedback db as feedback|<dhash>|<plugin>|<order id>. Admin pages read them through
+# sorted-set indexes scored by order id (all, per plugin, per status) and an order id -> key hash, never KEYS.
+
+def get_feedback_key(dhash: str, name: str, order_id: int | str) -> str:
+    return f'feedback|{dhash}|{name}|{order_id}'
+
+
+def parse_feedback_key(key: str) -> tuple[str, str, str]:
+    """``(dhash, plugin name, order id)`` of a feedback key."""
+    (dhash, name, order_id) = key.removeprefix('feedback|').rsplit('|', 2)
+    return dhash, name, order_id
+
+
+def get_feedback_index(plugin: str = '', status: str = '') -> str:
+    index = f'{get_settings().redis_prefix}feedback-index'
+    if plugin:
+        index += f'|plugin|{plugin}'
+    if status:
+        index += f'|status|{status}'
+    return index
+
+
+async def resolve_feedback_index(r_fb, plugin: str = '', status: str = '') -> str:
+    """Index to page for the given filters. Feedback is indexed per plugin and per status, filtering
+    by both intersects the two into a temporary index (rebuilt on every call, so it is never stale)."""
+    index = get_feedback_index(plugin, status)
+    if plugin and status:
+        async with r_fb.pipeline() as pipe:
+            # scores are order ids in both, weighting the status index 0 keeps them
+            pipe.zinterstore(index, {get_feedback_index(plugin=plugin): 1, get_feedback_index(status=status): 0})
+            pipe.expire(index, get_settings().feedback_filter_ttl)
+            await pipe.execute()
+    return index
+
+
+def _get_feedback_keys() -> str:
+    return f'{get_settings().redis_prefix}feedback-keys'
+
+
+def index_feedback(pipe, key: str, status: str):
+    """Queue the index entries of feedback ``key`` on ``pipe`` (sync or async, it is executed by the caller)."""
+    (_, name, order_id) = parse_feedback_key(key)
+    pipe.hset(_get_feedback_keys(), order_id, key)
+    for index in (get_feedback_index(), get_feedback_index(plugin=name), get_feedback_index(status=status)):
+        pipe.zadd(index, {order_id: int(order_id)})
+
+
+def unindex_feedback(pipe, key: str, status: str):
+    (_, name, order_id) = parse_feedback_key(key)
+    pipe.hdel(_get_feedback_keys(), order_id)
+    for index in (get_feedback_index(), get_feedback_index(plugin=name), get_feedback_index(status=status)):
+        pipe.zrem(index, order_id)
+
+
+async def get_feedback_key_by_id(r_fb, order_id: int | str) -> str | None:
+    return await r_fb.hget(_get_feedback_keys(), str(order_id))
+
+
+async def page_feedback(r_fb, index: str, cursor: int | None = None, count: int = 0) -> tuple[list[str], int | None]:
+    """Feedback keys of ``index``, newest first, starting below order id ``cursor``.
+
+    Returns the keys and the cursor of the next page (None on the last page). Cursors are order ids,
+    so pages stay stable while feedback is added or solved.
+    """
+    count = count or get_settings().feedback_page_size
+    order_ids = await r_fb.zrevrangebyscore(index, f'({cursor}' if cursor else '+inf', '-inf', start=0, num=count)
+    if not order_ids:
+        return [], None
+    keys = [key for key in await r_fb.hmget(_get_feedback_keys(), order_ids) if key]
+    return keys, int(order_ids[-1]) if len(order_ids) == count else None
+
+
+def backfill_feedback_index(redis_client) -> int:
+    """Index feedback stored before the indexes existed, with SCAN so Redis is never blocked. Safe to rerun."""
+    indexed = 0
+    batch = []
+    for key in redis_client.scan_iter(match='feedback|*', count=1000):
+        batch.append(key)
+        if len(batch) >= 1000:
+            indexed += _backfill_batch(redis_client, batch)
+            batch = []
+    if batch:
+        indexed += _backfill_batch(redis_client, batch)
+    logger.info(f"Indexed {indexed} feedback entries")
+    return indexed
+
+
+def _backfill_batch(redis_client, keys: list[str]) -> int:
+    pipe = redis_client.pipeline(transaction=False)
+    for key in keys:
+        pipe.hget(key, 'status')
+    statuses = pipe.execute()
+    pipe = redis_client.pipeline(transaction=False)
+    for (key, status) in zip(keys, statuses):
+        index_feedback(pipe, key, status or 'open')
+    pipe.execute()
+    return len(keys)
+
+
+FEEDBACK_TZ = timezone(timedelta(hours=8))
+EXPORT_FIELDS = ['order_id', 'plugin', 'dhash', 'version', 'status', 'reporter', 'create_time', 'content', 'exception', 'reply_log']
+
+
+async def load_feedback(r_fb, keys: list[str]) -> list[tuple[str, dict]]:
+    """``(key, feedback)`` for ``keys`` with one pipelined HGETALL, feedback solved since the keys were read is left out."""
+    async with r_fb.pipeline(transaction=False) as pipe:
+        for key in keys:
+            pipe.hgetall(key)
+        feedbacks = await pipe.execute()
+    return [(key, feedback) for (key, feedback) in zip(keys, feedbacks) if feedback]
+
+
+async def iter_feedback(r_fb, index: str, cursor: int | None = None) -> AsyncIterator[list[tuple[str, dict]]]:
+    """Every feedback of ``index`` newest first, in batches of ``feedback_export_batch_size``."""
+    batch_size = get_settings().feedback_export_batch_size
+    while True:
+        (keys, cursor) = await page_feedback(r_fb, index, cursor, batch_size)
+        if keys:
+            yield await load_feedback(r_fb, keys)
+        if cursor is None:
+            return
+
+
+def export_row(key: str, feedback: dict) -> dict:
+    (dhash, name, order_id) = parse_feedback_key(key)
+    return {
+        'order_id': int(order_id),
+        'plugin': name,
+        'dhash': dhash,
+        'version': feedback.get('version', ''),
+        'status': feedback.get('status', ''),
+        'reporter': feedback.get('reporter', ''),
+        'create_time': datetime.fromtimestamp(float(feedback.get('create_time', 0)), tz=FEEDBACK_TZ).strftime('%Y-%m-%d %H:%M:%S'),
+        'content': feedback.get('content', ''),
+        'exception': feedback.get('exception', ''),
+        'reply_log': feedback.get('reply_log', '[]'),
+    }
+
+
+async def stream_feedback_export(r_fb, index: str, export_format: str) -> AsyncIterator[bytes]:
+    """NDJSON or CSV (with header) of ``index``, one chunk per batch so memory stays constant."""
+    if export_format == 'csv':
+        yield '\ufeff'.encode() + _csv_lines([EXPORT_FIELDS])  # BOM, so Excel reads it as UTF-8
+    async for batch in iter_feedback(r_fb, index):
+        rows = [export_row(key, feedback) for (key, feedback) in batch]
+        if export_format == 'csv':
+            yield _csv_lines([[row[field] for field in EXPORT_FIELDS] for row in rows])
+        else:
+            yield b''.join(orjson.dumps({**row, 'reply_log': orjson.loads(row['reply_log'])}) + b'\n' for row in rows)
+
+
+def _csv_lines(rows: list[list]) -> bytes:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue().encode()
@@ -0,0 +1,67 @@
+import os
+import re
+import stat
+from mimetypes import guess_type
+from typing import NamedTuple, Optional
+
+from logs import logger
+
+FILENAME_REGEX = r"(?P<name>.*?)\.(?P<hash>.{64})\.(?P<ext>.*)"
+
+
+def get_file_cache_dir() -> str:
+    return os.getenv('CACHE_DIR', 'cache')
+
+
+class IndexedFile(NamedTuple):
+    path: str
+    clean_name: str  # name without the hash, sent as the download file name
+    media_type: str
+    etag: str  # names embed the sha256 of the content, so it is a strong validator
+    stat_result: os.stat_result
+
+
+class FileIndex():
+    """Per-worker index of the content-addressed file cache, hashed name -> IndexedFile.
+
+    Built at startup and extended by ``cache_file``. Cached files never change once written,
+    so a hit costs no syscall; names missing from the index (cached by another process since
+    the scan) are stat'ed once and added.
+    """
+
+    def __init__(self):
+        self.files: dict[str, IndexedFile] = {}
+
+    def add(self, file_name: str, file_path: str) -> Optional[IndexedFile]:
+        match = re.match(FILENAME_REGEX, file_name)
+        if not match:
+            return None
+        try:
+            stat_result = os.stat(file_path)
+        except OSError:
+            return None
+        if not stat.S_ISREG(stat_result.st_mode):
+            return None
+        clean_name = f"{match.group('name')}.{match.group('ext')}"
+        indexed = IndexedFile(file_path, clean_name, guess_type(clean_name)[0] or "text/plain",
+                              f'"{match.group("hash")}"', stat_result)
+        self.files[file_name] = indexed
+        return indexed
+
+    def get(self, file_name: str) -> Optional[IndexedFile]:
+        indexed = self.files.get(file_name)
+        if indexed is None:
+            indexed = self.add(file_name, os.path.join(get_file_cache_dir(), file_name))
+        return indexed
+
+    def build(self):
+        cache_dir = get_file_cache_dir()
+        os.makedirs(cache_dir, exist_ok=True)
+        self.files = {}
+        with os.scandir(cache_dir) as entries:
+            for entry in entries:
+                self.add(entry.name, entry.path)
+        logger.info(f"Indexed {len(self.files)} cached files in {cache_dir}")
+
+
+file_index = FileIndex()
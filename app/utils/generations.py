@@ -0,0 +1,119 @@
+from typing import Optional
+
+from logs import logger
+from .cache import invalidate_cache, read_cache
+from .common import get_settings
+
+# Moves the pointer forward only, a regen finishing after a newer one must not roll readers back. Ordered by rank,
+# then id: a regen ranks as its own id, a copy of a generation (see regen_pluginmaster_translations) as its source,
+# so a regen that started before the copy still replaces it.
+_FLIP_SCRIPT = """
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+local rank = tonumber(redis.call('GET', KEYS[2]) or current)
+local new_id = tonumber(ARGV[1])
+local new_rank = tonumber(ARGV[2])
+if new_rank > rank or (new_rank == rank and new_id > current) then
+    redis.call('SET', KEYS[1], ARGV[1])
+    redis.call('SET', KEYS[2], ARGV[2])
+    return 1
+end
+return 0
+"""
+
+PLUGIN_GENERATION = 'plugin'  # pluginmaster namespaces, fragments and plugin_name_list
+
+
+def get_generation_pointer(name: str) -> str:
+    return f'{get_settings().redis_prefix}generation|{name}'
+
+
+def _get_generation_rank(name: str) -> str:
+    return f'{get_settings().redis_prefix}generation-rank|{name}'
+
+
+def get_generation_rank(redis_client, name: str) -> int:
+    """Rank of the current generation (its id for generations published before ranks existed)."""
+    (rank, current) = redis_client.mget(_get_generation_rank(name), get_generation_pointer(name))
+    return int(rank or current or 0)
+
+
+def _get_generation_counter(name: str) -> str:
+    return f'{get_settings().redis_prefix}generation-counter|{name}'
+
+
+def _get_generation_index(name: str) -> str:
+    return f'{get_settings().redis_prefix}generations|{name}'
+
+
+def _get_generation_keys(name: str, generation: int) -> str:
+    return f'{get_settings().redis_prefix}generation-keys|{name}@{generation}'
+
+
+def versioned_key(key: str, generation: Optional[int]) -> str:
+    """``key`` as written by ``generation``, the plain key for data published before generations existed."""
+    return f'{key}@{generation}' if generation else key
+
+
+class Generation():
+    """Keys written by one regen run.
+
+    Every key goes through ``key()``, which returns ``<key>@<generation>``; ``publish()`` queues the
+    pointer flip on the task's transactional pipeline, so readers switch from one complete generation
+    to the next. Generation keys never change once published, so per-worker caches only follow the pointer.
+    ``rank`` is the generation's id unless it copies another one, then it is the source's rank.
+    """
+
+    def __init__(self, redis_client, name: str, rank: Optional[int] = None):
+        self.name = name
+        self.id = redis_client.incr(_get_generation_counter(name))
+        self.rank = rank or self.id
+        self.keys: set[str] = set()
+
+    def key(self, key: str) -> str:
+        key = versioned_key(key, self.id)
+        self.keys.add(key)
+        return key
+
+    def publish(self, pipe):
+        if self.keys:
+            pipe.sadd(_get_generation_keys(self.name, self.id), *self.keys)
+        pipe.zadd(_get_generation_index(self.name), {str(self.id): self.id})
+        pipe.eval(_FLIP_SCRIPT, 2, get_generation_pointer(self.name), _get_generation_rank(self.name), self.id, self.rank)
+        invalidate_cache(pipe, get_generation_pointer(self.name))
+
+
+def collect_generations(redis_client, name: str):
+    """Delete generations older than the current one, except the ``generation_keep`` latest of them
+    (readers may still hold the previous pointer until the invalidation reaches them)."""
+    current = int(redis_client.get(get_generation_pointer(name)) or 0)
+    older = [int(x) for x in redis_client.zrangebyscore(_get_generation_index(name), '-inf', f'({current}')]
+    stale = older[:-get_settings().generation_keep] if get_settings().generation_keep else older
+    if not stale:
+        return
+    key_sets = [_get_generation_keys(name, generation) for generation in stale]
+    pipe = redis_client.pipeline()
+    for key_set in key_sets:
+        pipe.smembers(key_set)
+    keys = set().union(*pipe.execute())
+    pipe = redis_client.pipeline()
+    if keys:
+        pipe.delete(*keys)
+    pipe.delete(*key_sets)
+    pipe.zrem(_get_generation_index(name), *[str(x) for x in stale])
+    pipe.execute()
+    logger.info(f"Collected {len(stale)} old {name} generations ({len(keys)} keys), current is {current}")
+
+
+def get_published_keys(redis_client, name: str) -> tuple[int, dict[str, str]]:
+    """Current generation and its keys, as ``{key: versioned key}``."""
+    current = int(redis_client.get(get_generation_pointer(name)) or 0)
+    if not current:
+        return (0, {})
+    keys = redis_client.smembers(_get_generation_keys(name, current))
+    suffix = f'@{current}'
+    return (current, {key.removesuffix(suffix): key for key in keys})
+
+
+async def get_current_generation(r, name: str) -> Optional[int]:
+    """Generation readers should use, from the read cache (the pointer is invalidated when it moves)."""
+    return await read_cache.get(r, get_generation_pointer(name), decode=int)
@@ -0,0 +1,100 @@
+"""JSON with comments, as used by plugin manifests.
+
+Accepts ``//``, ``#`` and ``/* */`` comments, trailing commas and a UTF-8 BOM (a superset of what
+commentjson parses), strips them in one regex pass and decodes with orjson.
+
+``python -m app.utils.jsonc <repo dir>`` benchmarks against commentjson on the manifests
+under ``<repo dir>/*/*/*.json``, the conformance cases live in ``tests/test_jsonc.py``.
+"""
+import json
+import re
+
+import orjson
+
+# Strings are matched first so comment markers / commas inside them are left alone.
+_TOKEN_REGEX = re.compile(
+    r'"(?:[^"\\\n]|\\.)*"'
+    r'|(?://|#)[^\n]*'
+    r'|/\*.*?\*/'
+    r'|,(?=(?:\s|(?://|#)[^\n]*|/\*.*?\*/)*[\]}])',
+    re.DOTALL,
+)
+_BIG_INT_REGEX = re.compile(r'[:\[,]\s*-?\d{19}')
+
+
+class JSONCDecodeError(ValueError):
+    def __init__(self, name: str, msg: str, lineno: int, colno: int):
+        super().__init__(f"{name}: {msg} at line {lineno} column {colno}")
+        self.name = name
+        self.msg = msg
+        self.lineno = lineno
+        self.colno = colno
+
+
+def _strip_token(match: re.Match) -> str:
+    token = match.group()
+    if token[0] == '"':
+        return token
+    if token.startswith('/*'):
+        return '\n' * token.count('\n')  # keep line numbers of later errors right
+    return ''
+
+
+def strip_jsonc(text: str) -> str:
+    return _TOKEN_REGEX.sub(_strip_token, text)
+
+
+def loads(content: str | bytes, name: str = '<string>'):
+    if isinstance(content, bytes):
+        content = content.decode('utf-8-sig')
+    else:
+        content = content.removeprefix('\ufeff')
+    stripped = strip_jsonc(content)
+    if not _BIG_INT_REGEX.search(stripped):  # orjson cannot keep integers beyond 64 bits exact
+        try:
+            return orjson.loads(stripped)
+        except orjson.JSONDecodeError:
+            pass  # reported with json's line / column below
+    try:
+        return json.loads(stripped)
+    except json.JSONDecodeError as e:
+        raise JSONCDecodeError(name, e.msg, e.lineno, e.colno) from None
+
+
+def load_file(path: str, name: str = ''):
+    with open(path, 'rb') as f:
+        return loads(f.read(), name or path)
+
+
+def benchmark(repo_dir: str):
+    import glob
+    import time
+    import commentjson
+
+    paths = sorted(glob.glob(f'{repo_dir}/*/*/*.json'))
+    contents = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            contents.append((path, f.read()))
+    timings = {}
+    for (label, parse) in [('commentjson', lambda b: commentjson.loads(b.decode('utf-8-sig'))), ('jsonc', loads)]:
+        start = time.perf_counter()
+        results = []
+        for (_, content) in contents:
+            try:
+                results.append(parse(content))
+            except Exception as e:
+                results.append(e)
+        timings[label] = (time.perf_counter() - start, results)
+    mismatches = [path for ((path, _), a, b) in zip(contents, timings['commentjson'][1], timings['jsonc'][1])
+                  if not isinstance(a, Exception) and a != b]
+    (old, _), (new, _) = timings['commentjson'], timings['jsonc']
+    print(f"{len(contents)} manifests: commentjson {old * 1000:.1f} ms, jsonc {new * 1000:.1f} ms ({old / max(new, 1e-9):.0f}x)")
+    print(f"{len(mismatches)} mismatches" + (f": {mismatches[:10]}" if mismatches else ""))
+
+
+if __name__ == '__main__':
+    import sys
+
+    for repo in sys.argv[1:]:
+        benchmark(repo)
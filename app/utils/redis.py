@@ -1,4 +1,5 @@
 import redis
+import redis.asyncio as aioredis
 from .common import get_settings
 from logs import logger
 
@@ -15,6 +16,51 @@ class RedisFeedBack():
         return redis.Redis(host=settings.redis_host, port=settings.redis_port, db=1, decode_responses=True)
 
 
+class AsyncRedis():
+    """Per-worker asyncio connection pools, opened and closed by the app lifespan."""
+    pools: dict[int, aioredis.ConnectionPool] = {}
+
+    @classmethod
+    def create_pool(cls, db: int = 0) -> aioredis.ConnectionPool:
+        settings = get_settings()
+        return aioredis.ConnectionPool(
+            host=settings.redis_host,
+            port=int(settings.redis_port),
+            db=db,
+            decode_responses=True,
+            max_connections=settings.redis_max_connections,
+            socket_timeout=settings.redis_socket_timeout,
+            socket_connect_timeout=settings.redis_socket_connect_timeout,
+        )
+
+    @classmethod
+    async def open(cls):
+        for db in (0, 1):
+            if db not in cls.pools:
+                cls.pools[db] = cls.create_pool(db)
+        logger.info(f"Opened async redis pools (max_connections={get_settings().redis_max_connections})")
+
+    @classmethod
+    async def close(cls):
+        pools, cls.pools = cls.pools, {}
+        for pool in pools.values():
+            await pool.disconnect()
+
+    @classmethod
+    def get_client(cls, db: int = 0) -> aioredis.Redis:
+        if db not in cls.pools:  # e.g. used outside of the app lifespan
+            cls.pools[db] = cls.create_pool(db)
+        return aioredis.Redis(connection_pool=cls.pools[db])
+
+
+async def get_redis() -> aioredis.Redis:
+    return AsyncRedis.get_client(0)
+
+
+async def get_redis_feedback() -> aioredis.Redis:
+    return AsyncRedis.get_client(1)
+
+
 def load_plugin_count(plugin_count):
     settings = get_settings()
     r = Redis.create_client()
@@ -24,5 +70,3 @@ def load_plugin_count(plugin_count):
         r.hset(f'{settings.redis_prefix}plugin-count', plugin, count)
         logger.info(f'Setting plugin download counter of {plugin} to {count}')
     r.hset(f'{settings.redis_prefix}plugin-count', 'accumulated', total)
-
-
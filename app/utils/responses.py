@@ -1,14 +1,139 @@
+import base64
+import hashlib
 import json
+from fastapi import Request
 from fastapi.responses import Response
 
+from .cache import read_cache
+from .common import get_settings
+from .compression import negotiate_encoding, variant_etag, base_etag
+
+DOWNLOAD_COUNT_MARKER = '__XLWEB_DOWNLOAD_COUNT__'
+FRAGMENT_SEPARATOR = '\x00'  # never emitted raw by json.dumps(ensure_ascii=True)
+
+
+def pretty_json_dumps(content) -> str:
+    return json.dumps(
+        content,
+        ensure_ascii=True,
+        allow_nan=False,
+        indent=2,
+        separators=(", ", ": "),
+    )
+
+
 class PrettyJSONResponse(Response):
     media_type = "application/json"
 
     def render(self, content) -> bytes:
-        return json.dumps(
-            content,
-            ensure_ascii=True,
-            allow_nan=False,
-            indent=2,
-            separators=(", ", ": "),
-        ).encode("utf-8")
+        return pretty_json_dumps(content).encode("utf-8")
+
+
+def dump_pluginmaster_fragment(plugin_meta: dict) -> str:
+    """Serialize one pluginmaster entry exactly as PrettyJSONResponse would inside the list,
+    split around its DownloadCount value so the live count can be spliced in later.
+
+    Returns ``"<InternalName>\\0<head>\\0<tail>"``.
+    """
+    plugin_meta = {**plugin_meta, "DownloadCount": DOWNLOAD_COUNT_MARKER}
+    entry = pretty_json_dumps([plugin_meta])[2:-2]  # strip the "[\n" and "\n]" of the wrapping list
+    head, tail = entry.split(f'"{DOWNLOAD_COUNT_MARKER}"', 1)
+    return FRAGMENT_SEPARATOR.join([plugin_meta["InternalName"], head, tail])
+
+
+def apply_pluginmaster_translations(pluginmaster: list[dict], descriptions: dict, punchlines: dict) -> list[dict]:
+    translated = []
+    for plugin in pluginmaster:
+        plugin_name = plugin['InternalName']
+        translated.append({
+            **plugin,
+            'Description': descriptions.get(plugin_name, plugin.get('Description')),
+            'Punchline': punchlines.get(plugin_name, plugin.get('Punchline')),
+        })
+    return translated
+
+
+def split_pluginmaster_fragments(fragments: list[str]) -> tuple[list[str], list[tuple[str, str]]]:
+    names = []
+    parts = []
+    for fragment in fragments:
+        name, head, tail = fragment.split(FRAGMENT_SEPARATOR, 2)
+        names.append(name)
+        parts.append((head, tail))
+    return names, parts
+
+
+def render_pluginmaster(parts: list[tuple[str, str]], download_counts: list) -> bytes:
+    if not parts:
+        return b"[]"
+    entries = [f"{head}{int(count or 0)}{tail}" for ((head, tail), count) in zip(parts, download_counts)]
+    return ("[\n" + ", \n".join(entries) + "\n]").encode("utf-8")
+
+
+def make_etag(content: str | bytes) -> str:
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    return f'"{hashlib.blake2b(content, digest_size=16).hexdigest()}"'
+
+
+def combine_etags(*parts) -> str:
+    """Strong validator for a response derived from several stored documents / live values."""
+    return make_etag("|".join(str(part) for part in parts))
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match or not etag:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [base_etag(tag.strip().removeprefix("W/")) for tag in if_none_match.split(",")]
+    return base_etag(etag) in candidates
+
+
+def cache_headers(etag: str, encoding: str | None = None) -> dict:
+    headers = {
+        "ETag": variant_etag(etag, encoding),
+        "Cache-Control": get_settings().document_cache_control,
+        "Vary": "Accept-Encoding",
+    }
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return headers
+
+
+def not_modified(etag: str, encoding: str | None = None) -> Response:
+    headers = cache_headers(etag, encoding)
+    headers.pop("Content-Encoding", None)
+    return Response(status_code=304, headers=headers)
+
+
+def document_response(content: str | bytes, etag: str = "", media_type: str = "application/json",
+                      encoding: str | None = None) -> Response:
+    """``content`` is already encoded with ``encoding`` when one is given."""
+    return Response(content, media_type=media_type, headers=cache_headers(etag or make_etag(content), encoding))
+
+
+async def hget_document(request: Request, r, key: str, field: str) -> Response | None:
+    """Serve a JSON document stored by a regen task (see ``store_document``) with ETag validation.
+
+    Both the body and its stored ``<field>-etag`` come from the worker's read cache, so a matching
+    If-None-Match is answered without touching Redis or the body. Large documents are served from
+    the ``<field>-<encoding>`` variant compressed at regen time when the client accepts it.
+    Returns None when the document does not exist.
+    """
+    content, etag = await read_cache.hmget(r, key, [field, f"{field}-etag"])
+    if content is None:
+        return None
+    etag = etag or make_etag(content)
+    encoding = negotiate_encoding(request)
+    encoded = None
+    if encoding:
+        encoded = await read_cache.hget(r, key, f"{field}-{encoding}", decode=base64.b64decode)
+        if encoded is None:  # small document, left to GZipMiddleware
+            encoding = None
+    if etag_matches(request, etag):
+        return not_modified(etag, encoding)
+    if encoding:
+        return document_response(encoded, etag, encoding=encoding)
+    return document_response(content, etag)
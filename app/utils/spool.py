@@ -0,0 +1,266 @@
+import asyncio
+import glob
+import os
+import time
+from typing import Awaitable, Callable, Optional
+
+import orjson
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from logs import logger
+from .common import get_settings
+
+
+def get_spool_dir() -> str:
+    settings = get_settings()
+    return os.path.join(settings.root_path, settings.spool_dir) if settings.spool_dir else ''
+
+
+def _try_lock(f) -> bool:
+    """Non-blocking exclusive flock on ``f``, released when it is closed (or its process dies)."""
+    if fcntl is None:
+        return False
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return False
+    return True
+
+
+class Spool():
+    """Append-only disk log of outbound payloads whose delivery failed, replayed once the target is back.
+
+    Each worker writes its own segments (``<pid>-<time_ns>.log``), appends are buffered and written with
+    one fsync every ``spool_fsync_interval`` seconds (or ``spool_fsync_count`` entries). Full or idle
+    segments are sealed by renaming them to ``.ready``. Any worker's replayer claims a ready segment by
+    locking it and renaming it to ``.<pid>.claimed``, sends its entries at ``spool_replay_rate`` per
+    second and deletes it; entries left after a failure go back as a new ready segment.
+
+    Writers and replayers hold an flock on their open or claimed segment, so one nobody holds a lock
+    on belongs to a dead worker (pids are reused, they cannot tell). Every ``spool_recover_interval``
+    seconds such segments are sealed or released again, delivery is at-least-once.
+    Spooling needs flock, on Windows it stays off.
+    """
+
+    def __init__(self, name: str, send: Callable[[dict], Awaitable[bool]]):
+        self.name = name
+        self.send = send
+        self.buffer: list[bytes] = []
+        self.segment_path: Optional[str] = None
+        self.segment_file = None
+        self.claim_file = None
+        self.segment_size = 0
+        self.segment_opened = 0.0
+        self.down_until = 0.0
+        self.wakeup = asyncio.Event()
+        self.writer: Optional[asyncio.Task] = None
+        self.replayer: Optional[asyncio.Task] = None
+
+    @property
+    def path(self) -> str:
+        return os.path.join(get_spool_dir(), self.name)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(get_spool_dir()) and self.writer is not None
+
+    def is_down(self) -> bool:
+        """True while the target is known to be failing, callers then spool without trying it first."""
+        return time.monotonic() < self.down_until
+
+    def mark_down(self):
+        self.down_until = time.monotonic() + get_settings().spool_retry_interval
+
+    def append(self, payload: dict) -> bool:
+        """Queue ``payload`` for the next fsync batch, False when spooling is off (the caller drops it)."""
+        if not self.enabled:
+            return False
+        self.buffer.append(orjson.dumps(payload) + b'\n')
+        if len(self.buffer) >= get_settings().spool_fsync_count:
+            self.wakeup.set()
+        return True
+
+    def _seal(self):
+        if self.segment_path is None:
+            return
+        os.replace(self.segment_path, self.segment_path.removesuffix('.log') + '.ready')
+        self.segment_file.close()  # only now, recovery must not take the segment while it is still .log
+        self.segment_path = self.segment_file = None
+
+    def _open_segment(self):
+        os.makedirs(self.path, exist_ok=True)
+        path = os.path.join(self.path, f'{os.getpid()}-{time.time_ns()}')
+        # locked before it shows up as .log, which recovery would otherwise take for abandoned
+        self.segment_file = open(f'{path}.tmp', 'ab')
+        _try_lock(self.segment_file)
+        os.replace(f'{path}.tmp', f'{path}.log')
+        self.segment_path = f'{path}.log'
+        self.segment_size = 0
+        self.segment_opened = time.monotonic()
+
+    def _write(self, lines: list[bytes]):
+        settings = get_settings()
+        if self.segment_path is None:
+            self._open_segment()
+        self.segment_file.writelines(lines)
+        self.segment_file.flush()
+        os.fsync(self.segment_file.fileno())
+        self.segment_size = self.segment_file.tell()
+        if self.segment_size >= settings.spool_segment_size:
+            self._seal()
+
+    def _flush(self, seal: bool = False):
+        lines, self.buffer = self.buffer, []
+        if lines:
+            self._write(lines)
+        # idle segments are sealed too, so the replayer does not wait for them to fill up
+        if seal or (self.segment_path and time.monotonic() - self.segment_opened >= get_settings().spool_segment_age):
+            self._seal()
+
+    async def _run_writer(self):
+        interval = get_settings().spool_fsync_interval
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            try:
+                await asyncio.to_thread(self._flush)
+            except OSError as e:
+                logger.error(f"Writing {self.name} spool failed: {e}")
+
+    def _recover(self):
+        """Seal segments of dead writers and release segments claimed by dead replayers."""
+        for path in glob.glob(os.path.join(self.path, '*.log')):
+            self._release(path, path.removesuffix('.log') + '.ready')
+        for path in glob.glob(os.path.join(self.path, '*.claimed')):
+            self._release(path, path.rsplit('.', 2)[0])
+
+    def _release(self, path: str, ready_path: str):
+        try:
+            with open(path, 'rb') as f:
+                if _try_lock(f):
+                    os.replace(path, ready_path)
+                    logger.warning(f"Recovered abandoned {self.name} spool segment {os.path.basename(path)}")
+        except FileNotFoundError:  # sealed or replayed since the glob
+            pass
+
+    def _claim(self) -> Optional[str]:
+        for path in sorted(glob.glob(os.path.join(self.path, '*.ready')), key=lambda x: os.path.basename(x).split('-')[1]):
+            try:
+                f = open(path, 'rb')
+            except FileNotFoundError:  # claimed by another worker
+                continue
+            claimed = f'{path}.{os.getpid()}.claimed'
+            try:
+                if _try_lock(f):
+                    os.rename(path, claimed)
+                    self.claim_file = f  # held until the segment is replayed or handed back
+                    return claimed
+            except FileNotFoundError:  # claimed and finished by another worker before we got the lock
+                pass
+            f.close()
+        return None
+
+    def _unclaim(self):
+        if self.claim_file is not None:
+            self.claim_file.close()
+            self.claim_file = None
+
+    def _requeue(self, lines: list[bytes]):
+        path = os.path.join(self.path, f'{os.getpid()}-{time.time_ns()}')
+        with open(f'{path}.tmp', 'wb') as f:
+            f.writelines(lines)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(f'{path}.tmp', f'{path}.ready')
+
+    async def _replay(self, claimed: str) -> bool:
+        with open(claimed, 'rb') as f:
+            lines = f.read().splitlines(keepends=True)
+        interval = 1 / get_settings().spool_replay_rate
+        sent = 0
+        for (i, line) in enumerate(lines):
+            try:
+                payload = orjson.loads(line)
+            except orjson.JSONDecodeError:  # torn write of a crashed worker
+                continue
+            if not await self.send(payload):
+                await asyncio.to_thread(self._requeue, lines[i:])
+                os.remove(claimed)
+                self.mark_down()
+                logger.warning(f"{self.name} is still failing, {len(lines) - i} spooled entries kept")
+                return False
+            sent += 1
+            await asyncio.sleep(interval)
+        os.remove(claimed)
+        self.down_until = 0
+        logger.info(f"Replayed {sent} spooled {self.name} entries")
+        return True
+
+    async def _run_replayer(self):
+        next_recover = 0.0
+        while True:
+            claimed = None
+            try:
+                if time.monotonic() >= next_recover:
+                    await asyncio.to_thread(self._recover)
+                    next_recover = time.monotonic() + get_settings().spool_recover_interval
+                if not self.is_down():
+                    claimed = await asyncio.to_thread(self._claim)
+                replayed = claimed is not None and await self._replay(claimed)
+                self._unclaim()
+                if not replayed:
+                    await asyncio.sleep(get_settings().spool_retry_interval if claimed else get_settings().spool_poll_interval)
+            except asyncio.CancelledError:
+                if claimed and os.path.exists(claimed):  # hand it back, it is sent again by whoever claims it
+                    os.replace(claimed, claimed.rsplit('.', 2)[0])
+                self._unclaim()
+                raise
+            except Exception as e:
+                self._unclaim()
+                logger.error(f"Replaying {self.name} spool failed: {e}")
+                await asyncio.sleep(get_settings().spool_retry_interval)
+
+    async def start(self):
+        if get_spool_dir() and fcntl is not None and self.writer is None:
+            os.makedirs(self.path, exist_ok=True)
+            self.wakeup = asyncio.Event()  # bind to the running loop
+            self.writer = asyncio.create_task(self._run_writer())
+            self.replayer = asyncio.create_task(self._run_replayer())
+
+    async def stop(self):
+        for task in (self.replayer, self.writer):
+            if task is None:
+                continue
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        if self.writer is not None:
+            self.writer = self.replayer = None
+            await asyncio.to_thread(self._flush, True)
+
+
+spools: dict[str, Spool] = {}
+
+
+def register_spool(name: str, send: Callable[[dict], Awaitable[bool]]) -> Spool:
+    spools[name] = Spool(name, send)
+    return spools[name]
+
+
+async def start_spools():
+    for spool in spools.values():
+        await spool.start()
+
+
+async def stop_spools():
+    for spool in spools.values():
+        await spool.stop()
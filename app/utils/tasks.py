@@ -1,6 +1,8 @@
+import base64
 import codecs
 import concurrent.futures
-import hashlib
+import copy
+import multiprocessing
 import json
 import os
 import re
@@ -10,17 +12,24 @@ from datetime import datetime
 from itertools import product
 from typing import Union, Tuple
 
-import commentjson
+import git
 from github import Github
+from redis.exceptions import WatchError
 from termcolor import colored
 
 from logs import logger
 from .cdn.cloudflare import CloudFlareCDN
 from .cdn.ctcdn import CTCDN
 from .cdn.ottercloudcdn import OtterCloudCDN
-from .common import get_settings, cache_file, download_file
+from .cache import invalidate_cache
+from .common import get_settings, cache_file, download_file, download_files, hash_file, get_peak_rss
+from .compression import ENCODINGS, compress
+from .generations import PLUGIN_GENERATION, Generation, collect_generations, get_generation_pointer, get_generation_rank, \
+    get_published_keys
+from . import jsonc
 from .git import update_git_repo, get_repo_dir, get_user_repo_name
 from .redis import Redis
+from .responses import apply_pluginmaster_translations, dump_pluginmaster_fragment, make_etag
 from .s3 import create_client as create_s3_client, upload_file
 
 
@@ -35,6 +44,9 @@ def regen(task_list: list[str]):
             ok = colored("ok", "green") if result else colored("failed", "red")
             results_str += f"{task}: {ok}\n"
         logger.info(f"Regeneration tasks finished with results: {results_str.strip()}")
+    peak_rss = get_peak_rss()
+    if peak_rss:
+        logger.info(f"Peak RSS after regeneration: {peak_rss / 1024 / 1024:.1f} MiB")
 
     cdn_client_list = []
     for cdn in settings.cdn_list:
@@ -67,6 +79,7 @@ def regen_task(task: str):
             'dalamud': regen_dalamud,
             'dalamud_changelog': regen_dalamud_changelog,
             'plugin': regen_pluginmaster,
+            'plugin_translations': regen_pluginmaster_translations,
             'asset': regen_asset,
             'xl': regen_xivlauncher,
             'xivl': regen_xivlauncher,
@@ -98,6 +111,8 @@ def refresh_cdn_task(task_cdn: Tuple[str, Union[CloudFlareCDN, CTCDN, OtterCloud
             'dalamud_changelog': ['/Plugin/CoreChangelog'],
             'plugin': ['/Plugin/PluginMaster', f'/Plugin/PluginMaster?apiLevel={settings.plugin_api_level}',
                        f'/Plugin/PluginMaster?apiLevel={settings.plugin_api_level_test}'],
+            'plugin_translations': ['/Plugin/PluginMaster', f'/Plugin/PluginMaster?apiLevel={settings.plugin_api_level}',
+                                    f'/Plugin/PluginMaster?apiLevel={settings.plugin_api_level_test}'],
             'asset': ['/Dalamud/Asset/Meta'],
             'xl': ['/Proxy/Meta', '/Launcher/GetLease'],
             'xivl': ['/Proxy/Meta', '/Launcher/GetLease'],
@@ -120,6 +135,22 @@ def refresh_cdn_task(task_cdn: Tuple[str, Union[CloudFlareCDN, CTCDN, OtterCloud
         return False
 
 
+def store_document(redis_client, key: str, field: str, content: str):
+    """Publish a JSON document together with its strong validator (``<field>-etag``).
+
+    Large documents also get ``<field>-<encoding>`` variants (base64) compressed at the highest levels,
+    so request handlers never compress them.
+    """
+    mapping = {field: content, f'{field}-etag': make_etag(content)}
+    content_bytes = content.encode('utf8')
+    if len(content_bytes) >= get_settings().precompress_minimum_size:
+        for encoding in ENCODINGS:
+            mapping[f'{field}-{encoding}'] = base64.b64encode(compress(content_bytes, encoding)).decode()
+    else:
+        redis_client.hdel(key, *[f'{field}-{encoding}' for encoding in ENCODINGS])
+    redis_client.hset(key, mapping=mapping)
+
+
 DEFAULT_META = {
     "Changelog": "",
     "Tags": [],
@@ -130,6 +161,8 @@ DEFAULT_META = {
     "FeedbackWebhook": None,
 }
 
+PLUGIN_MANIFEST_CACHE_VERSION = '1'  # bump when the cached parse result changes shape
+
 PLUGIN_CACHE_FILES = [
     {
         'url': 'https://docs.google.com/spreadsheets/d/1z2skn_jokyj02Qv2GPEs6HSmAZVLiw2LbwQxkXPjiEs/gviz/tq?tqx=out:csv&sheet=main1',
@@ -142,12 +175,99 @@ PLUGIN_CACHE_FILES = [
 ]
 
 
-def parsing_pluginmaster(redis_client, settings, repo_url, plugin_list=None) -> tuple[list[dict], list[str], str]:
+def load_plugin_meta(plugin_dir: str, plugin: str) -> dict | None:
+    try:
+        return jsonc.load_file(os.path.join(plugin_dir, f'{plugin}/{plugin}.json'), name=f'{plugin}/{plugin}.json')
+    except FileNotFoundError:
+        logger.error(f"Cannot find plugin meta file for {plugin}")
+    except (ValueError, UnicodeDecodeError) as e:
+        logger.error(f"Cannot parse plugin meta file for {plugin}: {e}")
+    return None
+
+
+def load_plugin_manifests(redis_client, settings, repo_key: str, repo) -> tuple[dict, set[str] | None]:
+    """Parsed manifests cached by the last regen of this repo, and the ``<channel>/<plugin>`` dirs changed since
+    the commit it processed. Changed dirs are None when there is nothing usable to diff against."""
+    state = redis_client.hgetall(f'{settings.redis_prefix}plugin-manifests-state|{repo_key}')
+    if state.get('version') != PLUGIN_MANIFEST_CACHE_VERSION or not state.get('commit'):
+        return {}, None
+    try:
+        # against the working tree, so uncommitted changes count too
+        diff = repo.git.diff('--name-only', '--no-renames', state['commit'])
+    except git.GitCommandError as e:
+        logger.warning(f"Cannot diff {repo_key} from {state['commit']}, reparsing all plugins: {e}")
+        return {}, None
+    changed_dirs = set()
+    for path in diff.splitlines():
+        parts = path.split('/')
+        if len(parts) > 1:
+            changed_dirs.add(f'{parts[0]}/{parts[1]}')
+    manifests = redis_client.hgetall(f'{settings.redis_prefix}plugin-manifests|{repo_key}')
+    logger.info(f"{repo_key}: {len(changed_dirs)} plugin dirs changed since {state['commit'][:7]}")
+    return {key: json.loads(value) for (key, value) in manifests.items()}, changed_dirs
+
+
+def save_plugin_manifests(pipe, settings, repo_key: str, repo, updated: dict, removed: set[str], replace: bool = False):
+    """Queue the manifest cache update on ``pipe``, committed together with the pluginmaster it was built for."""
+    if replace:
+        pipe.delete(f'{settings.redis_prefix}plugin-manifests|{repo_key}')
+    if updated:
+        pipe.hset(f'{settings.redis_prefix}plugin-manifests|{repo_key}', mapping={k: json.dumps(v) for (k, v) in updated.items()})
+    if removed:
+        pipe.hdel(f'{settings.redis_prefix}plugin-manifests|{repo_key}', *removed)
+    pipe.hset(f'{settings.redis_prefix}plugin-manifests-state|{repo_key}',
+              mapping={'commit': repo.head.commit.hexsha, 'version': PLUGIN_MANIFEST_CACHE_VERSION})
+
+
+def get_regen_processes() -> int:
+    return get_settings().regen_processes or os.cpu_count() or 1
+
+
+def create_process_pool() -> concurrent.futures.ProcessPoolExecutor | None:
+    """Pool for CPU-bound regen work (manifest parsing, hashing), None when ``regen_processes`` is 1.
+
+    Workers are spawned rather than forked, regen runs next to other threads (and inside app workers).
+    """
+    processes = get_regen_processes()
+    if processes <= 1:
+        return None
+    return concurrent.futures.ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn'))
+
+
+def map_in_pool(executor, func, items: list[tuple]) -> list:
+    """``[func(*item) for item in items]``, in order, fanned out over ``executor`` when there is one.
+
+    Batches under ``regen_pool_min_items`` stay in-process; workers start on first use, so incremental
+    regens touching a few plugins never pay for spawning them.
+    """
+    if executor is None or len(items) < max(2, get_settings().regen_pool_min_items):
+        return [func(*item) for item in items]
+    chunksize = max(1, len(items) // (get_regen_processes() * 4))
+    return list(executor.map(func, *zip(*items), chunksize=chunksize))
+
+
+_worker_redis_client = None
+
+
+def cache_file_in_worker(file_path: str):
+    """cache_file for pool workers, which cannot share the caller's redis client."""
+    global _worker_redis_client
+    if _worker_redis_client is None:
+        _worker_redis_client = Redis.create_client()
+    return cache_file(file_path, _worker_redis_client)
+
+
+def parsing_pluginmaster(redis_client, settings, repo_url, plugin_list=None, repo=None,
+                         executor=None, pipe=None, generation: Generation | None = None) -> tuple[list[dict], list[str], str]:
+    """Build the pluginmaster of ``repo_url``. Writes are queued on ``pipe`` when given (the caller executes it),
+    else they are committed in one transaction before returning. The namespace is written into ``generation``
+    when given."""
     if plugin_list is None:
         plugin_list = list()
     plugin_list_length = len(plugin_list)
     (_, repo_name) = get_user_repo_name(repo_url)
-    (_, repo) = update_git_repo(repo_url)
+    if repo is None:
+        (_, repo) = update_git_repo(repo_url)
     branch = repo.active_branch.name
     plugin_namespace = f"plugin-{repo_name}-{branch}"
     logger.info(f"plugin_namespace: {plugin_namespace}")
@@ -159,7 +279,6 @@ def parsing_pluginmaster(redis_client, settings, repo_url, plugin_list=None) ->
         'stable': 'stable',
         'testing': 'testing-live'
     }
-    jsonc = commentjson
     stable_dir = os.path.join(plugin_repo_dir, channel_map['stable'])
     testing_dir = os.path.join(plugin_repo_dir, channel_map['testing'])
     if not os.path.exists(testing_dir):
@@ -173,67 +292,95 @@ def parsing_pluginmaster(redis_client, settings, repo_url, plugin_list=None) ->
     for (channel, channel_meta) in state['Channels'].items():
         for (plugin, plugin_meta) in channel_meta['Plugins'].items():
             last_updated[plugin] = int(datetime.fromisoformat(re.sub(r'(\.\d{6})\d+(?=[+-]\d{2}:\d{2}$)', r'\1', plugin_meta['TimeBuilt'])).timestamp())
-    # Generate pluginmaster
-    for plugin_dir in [stable_dir, testing_dir]:
-        for plugin in os.listdir(plugin_dir):
-            try:
-                with codecs.open(os.path.join(plugin_dir, f'{plugin}/{plugin}.json'), 'r', 'utf8') as f:
-                    plugin_meta = jsonc.load(f)
-            except FileNotFoundError:
-                logger.error(f"Cannot find plugin meta file for {plugin}")
+    # Generate pluginmaster, only plugin dirs changed since the last regen are read and hashed again
+    repo_key = os.path.basename(plugin_repo_dir)
+    (manifests, changed_dirs) = load_plugin_manifests(redis_client, settings, repo_key, repo)
+    updated_manifests = {}
+    seen_manifests = set()
+    file_cache_dir = os.path.join(settings.root_path, settings.file_cache_dir)
+    plugin_dirs = [(plugin_dir, plugin) for plugin_dir in [stable_dir, testing_dir] for plugin in os.listdir(plugin_dir)]
+    cached_manifests = set(manifests)
+    for changed_dir in changed_dirs or []:
+        manifests.pop(changed_dir, None)
+    # Parsing fans out over the pool, results are consumed below in directory order as before
+    to_parse = [(plugin_dir, plugin) for (plugin_dir, plugin) in plugin_dirs
+                if f'{os.path.basename(plugin_dir)}/{plugin}' not in manifests]
+    parsed = dict(zip(to_parse, map_in_pool(executor, load_plugin_meta, to_parse)))
+    plugin_names = list(dict.fromkeys(plugin for (_, plugin) in plugin_dirs))
+    download_counts = dict(zip(plugin_names, redis_client.hmget(f'{settings.redis_prefix}plugin-count', plugin_names))) \
+        if plugin_names else {}
+    hashed_names = {}
+    to_hash = []
+    for (plugin_dir, plugin) in plugin_dirs:
+        manifest_key = f'{os.path.basename(plugin_dir)}/{plugin}'
+        manifest = manifests.get(manifest_key)
+        if manifest is None:
+            plugin_meta = parsed[(plugin_dir, plugin)]
+            if plugin_meta is None:
                 continue
-            except Exception as e:
-                try:
-                    with codecs.open(os.path.join(plugin_dir, f'{plugin}/{plugin}.json'), 'r', 'utf-8-sig') as f:
-                        plugin_meta = jsonc.load(f)
-                except Exception as e:
-                    logger.error(f"Cannot parse plugin meta file for {plugin}")
-                    continue
-            api_level = int(plugin_meta.get("DalamudApiLevel", 0))
-            if settings.plugin_api_level - api_level > 1:
-                continue
-            if plugin_list_length > 0 and plugin in plugin_list:
-                continue
-            for key, value in DEFAULT_META.items():
-                if key not in plugin_meta:
-                    plugin_meta[key] = value
-            is_testing = plugin_dir == testing_dir
-            plugin_meta["IsTestingExclusive"] = is_testing
-            download_count = redis_client.hget(f'{settings.redis_prefix}plugin-count', plugin) or 0
-            plugin_meta["DownloadCount"] = int(download_count)
-            plugin_meta["LastUpdate"] = last_updated.get(plugin, plugin_meta.get("LastUpdate", 0))
-            plugin_meta["DownloadLinkInstall"] = settings.hosted_url.rstrip('/') \
-                                                 + '/Plugin/Download/' + f"{plugin}?isUpdate=False&isTesting=False&branch=api{api_level}"
-            plugin_meta["DownloadLinkUpdate"] = settings.hosted_url.rstrip('/') \
-                                                + '/Plugin/Download/' + f"{plugin}?isUpdate=True&isTesting=False&branch=api{api_level}"
-            plugin_meta["DownloadLinkTesting"] = settings.hosted_url.rstrip('/') \
-                                                 + '/Plugin/Download/' + f"{plugin}?isUpdate=False&isTesting=True&branch=api{api_level}"
-            plugin_latest_path = os.path.join(plugin_dir, f'{plugin}/latest.zip')
-            plugin_meta["IconUrl"] = f"https://s3test.ffxiv.wang/plugindistd17/stable/{plugin}/images/icon.png"
-
-            if is_testing:
-                plugin_meta["TestingAssemblyVersion"] = plugin_meta["AssemblyVersion"]
-                plugin_meta["TestingChangelog"] = plugin_meta["Changelog"]
-                plugin_meta["TestingDalamudApiLevel"] = api_level
-                plugin_meta["IconUrl"] = f"https://s3test.ffxiv.wang/plugindistd17/testing-live/{plugin}/images/icon.png"
-
-            (hashed_name, _) = cache_file(plugin_latest_path)
-            plugin_name = f"{plugin}-testing" if is_testing else plugin
-            redis_client.hset(f'{settings.redis_prefix}{plugin_namespace}', plugin_name, hashed_name)
-            if is_testing and plugin in stable_plugin_map:
-                stable_meta = stable_plugin_map[plugin]
-                stable_meta["TestingAssemblyVersion"] = plugin_meta["TestingAssemblyVersion"]
-                stable_meta["TestingChangelog"] = plugin_meta["TestingChangelog"]
-                stable_meta["TestingDalamudApiLevel"] = plugin_meta["TestingDalamudApiLevel"]
-                if "_Dip17Channel" in plugin_meta:
-                    stable_meta["_Dip17Channel"] = plugin_meta["_Dip17Channel"]
-                plugin_name_list.append(plugin)
-                continue
-            if not is_testing:
-                stable_plugin_map[plugin] = plugin_meta
-            pluginmaster.append(plugin_meta)
+            manifest = updated_manifests[manifest_key] = {'meta': plugin_meta, 'hashed_name': None}
+        seen_manifests.add(manifest_key)
+        plugin_meta = copy.deepcopy(manifest['meta'])
+        api_level = int(plugin_meta.get("DalamudApiLevel", 0))
+        if settings.plugin_api_level - api_level > 1:
+            continue
+        if plugin_list_length > 0 and plugin in plugin_list:
+            continue
+        for key, value in DEFAULT_META.items():
+            if key not in plugin_meta:
+                plugin_meta[key] = value
+        is_testing = plugin_dir == testing_dir
+        plugin_meta["IsTestingExclusive"] = is_testing
+        plugin_meta["DownloadCount"] = int(download_counts[plugin] or 0)
+        plugin_meta["LastUpdate"] = last_updated.get(plugin, plugin_meta.get("LastUpdate", 0))
+        plugin_meta["DownloadLinkInstall"] = settings.hosted_url.rstrip('/') \
+                                             + '/Plugin/Download/' + f"{plugin}?isUpdate=False&isTesting=False&branch=api{api_level}"
+        plugin_meta["DownloadLinkUpdate"] = settings.hosted_url.rstrip('/') \
+                                            + '/Plugin/Download/' + f"{plugin}?isUpdate=True&isTesting=False&branch=api{api_level}"
+        plugin_meta["DownloadLinkTesting"] = settings.hosted_url.rstrip('/') \
+                                             + '/Plugin/Download/' + f"{plugin}?isUpdate=False&isTesting=True&branch=api{api_level}"
+        plugin_latest_path = os.path.join(plugin_dir, f'{plugin}/latest.zip')
+        plugin_meta["IconUrl"] = f"https://s3test.ffxiv.wang/plugindistd17/stable/{plugin}/images/icon.png"
+
+        if is_testing:
+            plugin_meta["TestingAssemblyVersion"] = plugin_meta["AssemblyVersion"]
+            plugin_meta["TestingChangelog"] = plugin_meta["Changelog"]
+            plugin_meta["TestingDalamudApiLevel"] = api_level
+            plugin_meta["IconUrl"] = f"https://s3test.ffxiv.wang/plugindistd17/testing-live/{plugin}/images/icon.png"
+
+        plugin_name = f"{plugin}-testing" if is_testing else plugin
+        if manifest['hashed_name'] and os.path.isfile(os.path.join(file_cache_dir, manifest['hashed_name'])):
+            hashed_names[plugin_name] = manifest['hashed_name']
+        else:
+            to_hash.append((manifest_key, manifest, plugin_name, plugin_latest_path))
+        if is_testing and plugin in stable_plugin_map:
+            stable_meta = stable_plugin_map[plugin]
+            stable_meta["TestingAssemblyVersion"] = plugin_meta["TestingAssemblyVersion"]
+            stable_meta["TestingChangelog"] = plugin_meta["TestingChangelog"]
+            stable_meta["TestingDalamudApiLevel"] = plugin_meta["TestingDalamudApiLevel"]
+            if "_Dip17Channel" in plugin_meta:
+                stable_meta["_Dip17Channel"] = plugin_meta["_Dip17Channel"]
             plugin_name_list.append(plugin)
-
+            continue
+        if not is_testing:
+            stable_plugin_map[plugin] = plugin_meta
+        pluginmaster.append(plugin_meta)
+        plugin_name_list.append(plugin)
+
+    cached_files = map_in_pool(executor, cache_file_in_worker, [(plugin_latest_path,) for (*_, plugin_latest_path) in to_hash])
+    for ((manifest_key, manifest, plugin_name, _), (hashed_name, _)) in zip(to_hash, cached_files):
+        manifest['hashed_name'] = hashed_names[plugin_name] = hashed_name
+        updated_manifests[manifest_key] = manifest
+    own_pipe = pipe is None
+    if own_pipe:
+        pipe = redis_client.pipeline()
+    namespace_key = f'{settings.redis_prefix}{plugin_namespace}'
+    if hashed_names:
+        pipe.hset(generation.key(namespace_key) if generation else namespace_key, mapping=hashed_names)
+    save_plugin_manifests(pipe, settings, repo_key, repo, updated_manifests, cached_manifests - seen_manifests,
+                          replace=changed_dirs is None)
+    if own_pipe:
+        pipe.execute()
     return pluginmaster, plugin_name_list, plugin_namespace
 
 
@@ -247,30 +394,105 @@ def regen_pluginmaster(redis_client=None, repo_url: str = ''):
 
     repo_url_goatcorp = settings.plugin_repo_goatcorp
 
-    pluginmaster_cn, plugin_name_list_cn, plugin_namespace = parsing_pluginmaster(redis_client, settings, repo_url)
-    pluginmaster, _, _ = parsing_pluginmaster(redis_client, settings, repo_url_goatcorp, plugin_name_list_cn)
+    # Both repos are pulled at once, parsing stays in order since the goatcorp repo skips plugins the CN repo has
+    repo_urls = list(dict.fromkeys([repo_url, repo_url_goatcorp]))
+    with concurrent.futures.ThreadPoolExecutor() as pull_executor:
+        repos = dict(zip(repo_urls, pull_executor.map(lambda url: update_git_repo(url)[1], repo_urls)))
+    # Everything this task writes goes into a new generation, committed and made current at once at the end
+    pipe = redis_client.pipeline()
+    generation = Generation(redis_client, PLUGIN_GENERATION)
+    executor = create_process_pool()
+    try:
+        pluginmaster_cn, plugin_name_list_cn, plugin_namespace = parsing_pluginmaster(
+            redis_client, settings, repo_url, repo=repos[repo_url], executor=executor, pipe=pipe, generation=generation)
+        pluginmaster, _, _ = parsing_pluginmaster(
+            redis_client, settings, repo_url_goatcorp, plugin_name_list_cn, repo=repos[repo_url_goatcorp],
+            executor=executor, pipe=pipe, generation=generation)
+    finally:
+        if executor:
+            executor.shutdown()
     upload_plugin_icons(settings, repo_url_goatcorp)
     if repo_url != repo_url_goatcorp:
         upload_plugin_icons(settings, repo_url)
     pluginmaster += pluginmaster_cn
 
-    redis_client.hset(f'{settings.redis_prefix}{plugin_namespace}', 'pluginmaster', json.dumps(pluginmaster))
+    namespace_key = generation.key(f'{settings.redis_prefix}{plugin_namespace}')
+    pipe.hset(namespace_key, 'pluginmaster', json.dumps(pluginmaster))
+    fragments = [dump_pluginmaster_fragment(plugin) for plugin in translate_pluginmaster(redis_client, settings, pluginmaster)]
+    if fragments:
+        pipe.rpush(generation.key(f'{settings.redis_prefix}{plugin_namespace}|pluginmaster-fragments'), *fragments)
+    pipe.hset(namespace_key, 'pluginmaster-fragments-etag', make_etag('\n'.join(fragments)))
     plugin_name_list = []
     for plugin in pluginmaster:
         plugin_name = plugin['InternalName']
         plugin_name_list.append(plugin_name)
-    redis_client.delete(f'{settings.redis_prefix}plugin_name_list')
-    redis_client.rpush(f'{settings.redis_prefix}plugin_name_list', *plugin_name_list)
+    if plugin_name_list:
+        pipe.rpush(generation.key(f'{settings.redis_prefix}plugin_name_list'), *plugin_name_list)
+    generation.publish(pipe)
+    pipe.execute()
+    logger.info(f"Published pluginmaster generation {generation.id}")
+    collect_generations(redis_client, PLUGIN_GENERATION)
     upload_plugin_cache_files(settings)
     # print(f"Regenerated Pluginmaster for {plugin_namespace}: \n" + str(json.dumps(pluginmaster, indent=2)))
 
 
+def regen_pluginmaster_translations(redis_client=None):
+    """Re-translate the published pluginmaster fragments after new translations were loaded.
+
+    Translations are baked into the fragments at regen time, so this publishes a copy of the current
+    generation with fresh fragments instead of waiting for the next plugin regen (no repo is pulled).
+    The copy is only published while its source is still current (WATCH), else it is redone from the
+    new one; it ranks as its source, so a plugin regen already running still replaces it.
+    """
+    settings = get_settings()
+    if not redis_client:
+        redis_client = Redis.create_client()
+    for attempt in range(3):
+        with redis_client.pipeline() as pipe:
+            try:
+                pipe.watch(get_generation_pointer(PLUGIN_GENERATION))
+                (current, keys) = get_published_keys(pipe, PLUGIN_GENERATION)
+                if not current:
+                    logger.info("No pluginmaster generation published yet, nothing to translate")
+                    return
+                generation = Generation(redis_client, PLUGIN_GENERATION, rank=get_generation_rank(pipe, PLUGIN_GENERATION))
+                fragment_suffix = '|pluginmaster-fragments'
+                pluginmasters = {}
+                for key in [x for x in keys if x.endswith(fragment_suffix)]:
+                    namespace_key = key.removesuffix(fragment_suffix)
+                    pluginmasters[namespace_key] = json.loads(pipe.hget(keys[namespace_key], 'pluginmaster') or '[]')
+                pipe.multi()
+                for (key, versioned) in keys.items():
+                    if not key.endswith(fragment_suffix):
+                        pipe.copy(versioned, generation.key(key))
+                for (namespace_key, pluginmaster) in pluginmasters.items():
+                    fragments = [dump_pluginmaster_fragment(plugin) for plugin in translate_pluginmaster(redis_client, settings, pluginmaster)]
+                    if fragments:
+                        pipe.rpush(generation.key(namespace_key + fragment_suffix), *fragments)
+                    pipe.hset(generation.key(namespace_key), 'pluginmaster-fragments-etag', make_etag('\n'.join(fragments)))
+                generation.publish(pipe)
+                pipe.execute()
+            except WatchError:
+                logger.info("Pluginmaster generation moved while translating, retrying")
+                continue
+        logger.info(f"Published translated pluginmaster generation {generation.id} (from {current})")
+        collect_generations(redis_client, PLUGIN_GENERATION)
+        return
+    logger.error("Pluginmaster generation kept moving, translations are published by the next plugin regen")
+
+
+def translate_pluginmaster(redis_client, settings, pluginmaster: list[dict]) -> list[dict]:
+    if settings.default_pm_lang == 'en-US':
+        return pluginmaster
+    (desc_str, punchline_str) = redis_client.hmget(f'{settings.redis_prefix}crowdin', [
+        f'plugin-description-{settings.default_pm_lang}', f'plugin-punchline-{settings.default_pm_lang}'])
+    return apply_pluginmaster_translations(pluginmaster, json.loads(desc_str or '{}'), json.loads(punchline_str or '{}'))
+
+
 def upload_plugin_cache_files(settings):
     cache_dir = os.path.join(settings.root_path, settings.file_cache_dir)
-    file_paths = [
-        download_file(cache_item['url'], cache_dir, force=True, filename=cache_item['filename'])
-        for cache_item in PLUGIN_CACHE_FILES
-    ]
+    file_paths = download_files([cache_item['url'] for cache_item in PLUGIN_CACHE_FILES], cache_dir, force=True,
+                                filenames=[cache_item['filename'] for cache_item in PLUGIN_CACHE_FILES])
     s3_client = create_s3_client(settings)
     if not s3_client:
         return
@@ -309,7 +531,7 @@ def regen_asset(redis_client=None):
     cheatplugin_hash = ""
     for asset in asset_json["Assets"]:
         file_path = os.path.join(asset_repo_dir, asset["FileName"])
-        (hashed_name, _) = cache_file(file_path)
+        (hashed_name, _) = cache_file(file_path, redis_client)
         if "github" in asset["Url"]:  # only replace the github urls
             asset["Url"] = settings.hosted_url.rstrip('/') + '/File/Get/' + hashed_name
         if "cheatplugin.json" in asset["FileName"]:
@@ -317,13 +539,16 @@ def regen_asset(redis_client=None):
         asset_list.append(asset)
     asset_json["Assets"] = asset_list
     # print("Regenerated Assets: \n" + str(json.dumps(asset_json, indent=2)))
-    redis_client.hset(f'{settings.redis_prefix}asset', 'meta', json.dumps(asset_json))
+    pipe = redis_client.pipeline()
+    store_document(pipe, f'{settings.redis_prefix}asset', 'meta', json.dumps(asset_json))
     if cheatplugin_hash:
-        redis_client.hset(f'{settings.redis_prefix}asset', 'cheatplugin_hash', cheatplugin_hash)
-        with open(os.path.join(asset_repo_dir, "UIRes/cheatplugin.json"), "rb") as f:
-            bs = f.read()
-            cheatplugin_hash_sha256 = hashlib.sha256(bs).hexdigest().upper()
-            redis_client.hset(f'{settings.redis_prefix}asset', 'cheatplugin_hash_sha256', cheatplugin_hash_sha256)
+        cheatplugin_hash_sha256 = hash_file(os.path.join(asset_repo_dir, "UIRes/cheatplugin.json")).upper()
+        pipe.hset(f'{settings.redis_prefix}asset', mapping={
+            'cheatplugin_hash': cheatplugin_hash,
+            'cheatplugin_hash_sha256': cheatplugin_hash_sha256,
+        })
+    invalidate_cache(pipe, f'{settings.redis_prefix}asset')
+    pipe.execute()
 
 
 def regen_dalamud(redis_client=None):
@@ -338,6 +563,8 @@ def regen_dalamud(redis_client=None):
         branch_prefix = f'{branch_name}-'
     distrib_repo_dir = get_repo_dir(settings.distrib_repo)
     runtime_verlist = []
+    meta_json = {}
+    pipe = redis_client.pipeline()
     # release_version = {}
     for track in ["release", "stg", "canary"]:
         dist_dir = distrib_repo_dir if track == "release" else \
@@ -348,27 +575,31 @@ def regen_dalamud(redis_client=None):
             runtime_verlist.append(version_json['RuntimeVersion'])
         ext_format = settings.dalamud_format  # zip or 7z
         dalamud_path = os.path.join(dist_dir, f"latest.{ext_format}")
-        (hashed_name, _) = cache_file(dalamud_path)
+        (hashed_name, _) = cache_file(dalamud_path, redis_client)
         version_json['downloadUrl'] = settings.hosted_url.rstrip('/') + f'/File/Get/{hashed_name}'
         version_json['track'] = track
         if track == 'release':
             version_json['changelog'] = []
         if 'key' not in version_json and 'Key' not in version_json:
             version_json['key'] = None
-        redis_client.hset(f'{settings.redis_prefix}dalamud', f'dist-{branch_prefix}{track}', json.dumps(version_json))
+        store_document(pipe, f'{settings.redis_prefix}dalamud', f'dist-{branch_prefix}{track}', json.dumps(version_json))
+        meta_json[track] = version_json
         # if track == 'release':
         #     release_version = version_json
+    store_document(pipe, f'{settings.redis_prefix}dalamud', f'{branch_prefix}meta', json.dumps(meta_json))
+    runtime_urls = {}
     for version in runtime_verlist:
-        desktop_url = f'https://dotnetcli.azureedge.net/dotnet/WindowsDesktop/{version}/windowsdesktop-runtime-{version}-win-x64.zip'
-        (hashed_name, _) = cache_file(download_file(desktop_url))
-        redis_client.hset(f'{settings.redis_prefix}runtime', f'desktop-{version}', hashed_name)
-        dotnet_url = f'https://dotnetcli.azureedge.net/dotnet/Runtime/{version}/dotnet-runtime-{version}-win-x64.zip'
-        (hashed_name, _) = cache_file(download_file(dotnet_url))
-        redis_client.hset(f'{settings.redis_prefix}runtime', f'dotnet-{version}', hashed_name)
-    for hash_file in os.listdir(os.path.join(distrib_repo_dir, 'runtimehashes')):
-        version = re.search(r'(?P<ver>.*)\.json$', hash_file).group('ver')
-        (hashed_name, _) = cache_file(os.path.join(distrib_repo_dir, f'runtimehashes/{hash_file}'))
-        redis_client.hset(f'{settings.redis_prefix}runtime', f'hashes-{version}', hashed_name)
+        runtime_urls[f'desktop-{version}'] = f'https://dotnetcli.azureedge.net/dotnet/WindowsDesktop/{version}/windowsdesktop-runtime-{version}-win-x64.zip'
+        runtime_urls[f'dotnet-{version}'] = f'https://dotnetcli.azureedge.net/dotnet/Runtime/{version}/dotnet-runtime-{version}-win-x64.zip'
+    for (field, runtime_path) in zip(runtime_urls, download_files(list(runtime_urls.values()))):
+        (hashed_name, _) = cache_file(runtime_path, redis_client)
+        pipe.hset(f'{settings.redis_prefix}runtime', field, hashed_name)
+    for hash_json in os.listdir(os.path.join(distrib_repo_dir, 'runtimehashes')):
+        version = re.search(r'(?P<ver>.*)\.json$', hash_json).group('ver')
+        (hashed_name, _) = cache_file(os.path.join(distrib_repo_dir, f'runtimehashes/{hash_json}'), redis_client)
+        pipe.hset(f'{settings.redis_prefix}runtime', f'hashes-{version}', hashed_name)
+    invalidate_cache(pipe, f'{settings.redis_prefix}dalamud', f'{settings.redis_prefix}runtime')
+    pipe.execute()
     # return release_version
 
 
@@ -404,7 +635,10 @@ def regen_dalamud_changelog(redis_client=None):
             'date': tag.commit.commit.author.date.isoformat(),
             'changes': changes,
         })
-    redis_client.hset(f'{settings.redis_prefix}dalamud', 'changelog', json.dumps(changelogs))
+    pipe = redis_client.pipeline()
+    store_document(pipe, f'{settings.redis_prefix}dalamud', 'changelog', json.dumps(changelogs))
+    invalidate_cache(pipe, f'{settings.redis_prefix}dalamud')
+    pipe.execute()
 
 
 def regen_xivlauncher(redis_client=None):
@@ -430,22 +664,24 @@ def regen_xivlauncher(redis_client=None):
     else:
         pre_release = release = latest_release
 
+    pipe = redis_client.pipeline()
     for (idx, rel) in enumerate([pre_release, release]):
         release_type = 'prerelease' if idx == 0 else 'release'
-        redis_client.hset(f'{settings.redis_prefix}xivlauncher', f'{release_type}-tag', rel.tag_name)
+        pipe.hset(f'{settings.redis_prefix}xivlauncher', f'{release_type}-tag', rel.tag_name)
         changelog = ''
-        for asset in rel.get_assets():
-            asset_filepath = download_file(asset.browser_download_url, force=True)  # overwrite file
+        assets = list(rel.get_assets())
+        asset_filepaths = download_files([asset.browser_download_url for asset in assets], force=True)  # overwrite file
+        for (asset, asset_filepath) in zip(assets, asset_filepaths):
             if asset.name == 'RELEASES':
                 with codecs.open(asset_filepath, 'r', 'utf8') as f:
                     releases_list = f.read()
-                redis_client.hset(f'{settings.redis_prefix}xivlauncher', f'{release_type}-releaseslist', releases_list)
+                pipe.hset(f'{settings.redis_prefix}xivlauncher', f'{release_type}-releaseslist', releases_list)
                 continue
             if asset.name == 'CHANGELOG.txt':
                 with codecs.open(asset_filepath, 'r', 'utf8') as f:
                     changelog = f.read()
-            (hashed_name, _) = cache_file(asset_filepath)
-            redis_client.hset(
+            (hashed_name, _) = cache_file(asset_filepath, redis_client)
+            pipe.hset(
                 f'{settings.redis_prefix}xivlauncher',
                 f'{release_type}-{asset.name}',
                 hashed_name
@@ -458,11 +694,14 @@ def regen_xivlauncher(redis_client=None):
             'changelog': changelog,
             'when': rel.published_at.isoformat(),
         }
-        redis_client.hset(
+        store_document(
+            pipe,
             f'{settings.redis_prefix}xivlauncher',
             f'{release_type}-meta',
             json.dumps(meta)
         )
+    invalidate_cache(pipe, f'{settings.redis_prefix}xivlauncher')
+    pipe.execute()
 
 
 def regen_updater(redis_client=None):
@@ -470,7 +709,9 @@ def regen_updater(redis_client=None):
     if not redis_client:
         redis_client = Redis.create_client()
     settings = get_settings()
-    redis_client.delete(f'{settings.redis_prefix}updater')
+    # The hash is rebuilt inside the transaction, readers never see it empty
+    pipe = redis_client.pipeline()
+    pipe.delete(f'{settings.redis_prefix}updater')
     updater_repo_url = settings.updater_repo
     s = re.search(r'github.com[\/:](?P<user>.+)\/(?P<repo>.+)\.git', updater_repo_url)
     user, repo_name = s.group('user'), s.group('repo')
@@ -489,8 +730,8 @@ def regen_updater(redis_client=None):
             file_name = asset.name
             if file_name == 'release.zip':
                 asset_filepath = download_file(asset.browser_download_url, force=True)  # overwrite file
-                (hashed_name, _) = cache_file(asset_filepath)
-                redis_client.hset(
+                (hashed_name, _) = cache_file(asset_filepath, redis_client)
+                pipe.hset(
                     f'{settings.redis_prefix}updater',
                     f'{release_type}-asset',
                     hashed_name
@@ -499,11 +740,14 @@ def regen_updater(redis_client=None):
         'release': last_release.tag_name,
         'prerelease': pre_release.tag_name,
     }
-    redis_client.hset(
+    store_document(
+        pipe,
         f'{settings.redis_prefix}updater',
-        f'version',
+        'version',
         json.dumps(version_dict)
     )
+    invalidate_cache(pipe, f'{settings.redis_prefix}updater')
+    pipe.execute()
 
 
 def regen_xlassets(redis_client=None):
@@ -519,16 +763,20 @@ def regen_xlassets(redis_client=None):
     latest_integrity = integrity_files[0]
     with codecs.open(os.path.join(integrity_path, latest_integrity), 'r', 'utf8') as f:
         integrity_json = json.load(f)
-    redis_client.hset(
+    pipe = redis_client.pipeline()
+    pipe.hset(
         f'{settings.redis_prefix}xlassets',
         f'version',
         latest_integrity.split('.json')[0]
     )
-    redis_client.hset(
+    store_document(
+        pipe,
         f'{settings.redis_prefix}xlassets',
-        f'json',
+        'json',
         json.dumps(integrity_json)
     )
+    invalidate_cache(pipe, f'{settings.redis_prefix}xlassets')
+    pipe.execute()
 
 
 def flush_stg_code(redis_client=None) -> str:
@@ -536,5 +784,8 @@ def flush_stg_code(redis_client=None) -> str:
     if not redis_client:
         redis_client = Redis.create_client()
     stg_code = ''.join(secrets.choice(string.ascii_letters + string.digits) for _ in range(16))
-    redis_client.hset(f'{settings.redis_prefix}settings', 'stg_code', stg_code)
+    pipe = redis_client.pipeline()
+    pipe.hset(f'{settings.redis_prefix}settings', 'stg_code', stg_code)
+    invalidate_cache(pipe, f'{settings.redis_prefix}settings')
+    pipe.execute()
     return stg_code
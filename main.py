@@ -16,6 +16,9 @@ def cli():
     init_server = subparsers.add_parser('init', help='初始化服务器')
     init_server.set_defaults(handle=init_server_func)
 
+    feedback_index = subparsers.add_parser('feedback-index', help='为已有反馈建立索引')
+    feedback_index.set_defaults(handle=feedback_index_func)
+
     args = parser.parse_args()
     if hasattr(args, 'handle'):
         args.handle(args)
@@ -36,5 +39,11 @@ def init_server_func(args):
     regen_pluginmaster(repo_url="https://github.com/ottercorp/PluginDistD17.git")
 
 
+def feedback_index_func(args):
+    from app.utils.feedback import backfill_feedback_index
+    from app.utils.redis import RedisFeedBack
+    backfill_feedback_index(RedisFeedBack.create_client())
+
+
 if __name__ == '__main__':
     cli()
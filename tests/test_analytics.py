@@ -0,0 +1,50 @@
+import asyncio
+import json
+
+import pytest
+from starlette.requests import Request
+
+from app.utils import analytics
+from app.utils.cache import read_cache
+from app.utils.common import get_settings
+from app.utils.responses import hget_document
+
+
+class FakeRedis:
+    def __init__(self, hashes: dict):
+        self.hashes = hashes
+
+    async def hmget(self, key, fields):
+        return [self.hashes.get(key, {}).get(field) for field in fields]
+
+
+@pytest.fixture
+def dalamud_redis():
+    release = json.dumps({'AssemblyVersion': '9.1.0.9', 'track': 'release'})
+    r = FakeRedis({f'{get_settings().redis_prefix}dalamud': {'dist-release': release, 'dist-release-etag': '"e"',
+                                                             'dist-stg': json.dumps({'AssemblyVersion': '9.1.0.10'})}})
+    read_cache.subscribed = True
+    yield r
+    read_cache.subscribed = False
+    read_cache.clear()
+
+
+async def version_info(r):
+    request = Request({'type': 'http', 'method': 'GET', 'path': '/', 'headers': []})
+    return await hget_document(request, r, f'{get_settings().redis_prefix}dalamud', 'dist-release')
+
+
+@pytest.mark.parametrize('version_info_first', [True, False])
+def test_dalamud_versions_share_cache_with_version_info(dalamud_redis, version_info_first):
+    async def run():
+        if version_info_first:
+            response = await version_info(dalamud_redis)
+            versions = await analytics._get_dalamud_versions(dalamud_redis)
+        else:
+            versions = await analytics._get_dalamud_versions(dalamud_redis)
+            response = await version_info(dalamud_redis)
+        return response, versions
+
+    (response, versions) = asyncio.run(run())
+    assert versions == {'9.1.0.9', '9.1.0.10'}
+    assert json.loads(response.body)['AssemblyVersion'] == '9.1.0.9'
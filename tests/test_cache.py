@@ -0,0 +1,49 @@
+import asyncio
+import json
+
+from app.utils.cache import ReadCache
+
+
+class FakeRedis:
+    def __init__(self, hashes: dict):
+        self.hashes = hashes
+        self.calls = 0
+
+    async def hmget(self, key, fields):
+        self.calls += 1
+        return [self.hashes.get(key, {}).get(field) for field in fields]
+
+
+def make_cache() -> ReadCache:
+    cache = ReadCache()
+    cache.subscribed = True
+    return cache
+
+
+def test_hmget_is_cached():
+    r = FakeRedis({'k': {'a': '1'}})
+    cache = make_cache()
+    assert asyncio.run(cache.hget(r, 'k', 'a')) == '1'
+    assert asyncio.run(cache.hget(r, 'k', 'a')) == '1'
+    assert r.calls == 1
+
+
+def test_decoders_do_not_share_entries():
+    r = FakeRedis({'k': {'a': '{"x": 1}'}})
+    cache = make_cache()
+    assert asyncio.run(cache.hget(r, 'k', 'a')) == '{"x": 1}'
+    assert asyncio.run(cache.hget(r, 'k', 'a', decode=json.loads)) == {'x': 1}
+    assert asyncio.run(cache.hget(r, 'k', 'a')) == '{"x": 1}'
+    assert asyncio.run(cache.hget(r, 'k', 'a', decode=json.loads)) == {'x': 1}
+    assert r.calls == 2
+
+
+def test_invalidate_drops_every_decoder():
+    r = FakeRedis({'k': {'a': '{"x": 1}'}})
+    cache = make_cache()
+    asyncio.run(cache.hget(r, 'k', 'a'))
+    asyncio.run(cache.hget(r, 'k', 'a', decode=json.loads))
+    r.hashes['k']['a'] = '{"x": 2}'
+    cache.invalidate('k')
+    assert asyncio.run(cache.hget(r, 'k', 'a')) == '{"x": 2}'
+    assert asyncio.run(cache.hget(r, 'k', 'a', decode=json.loads)) == {'x': 2}
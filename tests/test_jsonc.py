@@ -0,0 +1,49 @@
+import pytest
+
+from app.utils import jsonc
+
+CONFORMANCE_CASES = [
+    ('{"a": 1}', {'a': 1}),
+    ('\ufeff{"a": 1}', {'a': 1}),
+    ('{"a": 1, // comment\n"b": 2}', {'a': 1, 'b': 2}),
+    ('{"a": 1, # comment\n"b": 2}', {'a': 1, 'b': 2}),
+    ('{"a": /* multi\nline */ 1}', {'a': 1}),
+    ('{"a": [1, 2,], "b": {"c": 3,},}', {'a': [1, 2], 'b': {'c': 3}}),
+    ('{"a": [1, 2, // trailing\n]}', {'a': [1, 2]}),
+    ('{"url": "https://example.com/#x", "s": "a,]"}', {'url': 'https://example.com/#x', 's': 'a,]'}),
+    ('{"s": "quote \\" // not a comment"}', {'s': 'quote " // not a comment'}),
+    ('{"s": "back\\\\"} // end', {'s': 'back\\'}),
+    ('{"n": 123456789012345678901234567890}', {'n': 123456789012345678901234567890}),
+    ('{"u": "\\u00e9\u4e2d"}', {'u': '\u00e9\u4e2d'}),
+    ('[]', []),
+]
+
+INVALID_CASES = [
+    ('{"a": 1,\n\n"b": }', 3),
+    ('{"a": /* x\ny */ oops}', 2),
+    ('{"a": 1', 1),
+]
+
+
+@pytest.mark.parametrize('text, expected', CONFORMANCE_CASES)
+def test_loads(text, expected):
+    assert jsonc.loads(text) == expected
+
+
+@pytest.mark.parametrize('text, expected', CONFORMANCE_CASES)
+def test_loads_bytes(text, expected):
+    assert jsonc.loads(text.encode('utf-8')) == expected
+
+
+@pytest.mark.parametrize('text, lineno', INVALID_CASES)
+def test_invalid(text, lineno):
+    with pytest.raises(jsonc.JSONCDecodeError) as exc_info:
+        jsonc.loads(text, 'case')
+    assert exc_info.value.lineno == lineno
+    assert exc_info.value.name == 'case'
+
+
+def test_load_file(tmp_path):
+    path = tmp_path / 'manifest.json'
+    path.write_bytes('\ufeff{"Name": "x", // comment\n}'.encode('utf-8'))
+    assert jsonc.load_file(str(path)) == {'Name': 'x'}